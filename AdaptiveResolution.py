@@ -0,0 +1,68 @@
+# Adaptive resolution control for EGR 530
+# Changes the pyramid level a detector runs at so that each frame stays within a latency budget
+
+import time
+
+# Wraps a detector (HoughLaneDetector or BandLaneDetector) and has the same Process/DrawOverlay/ResultRow interface
+# - If the average frame time goes over the budget, detection moves to the next smaller pyramid level
+# - If the frame time at the next larger level (about 4x the pixels) would still fit within the budget with some
+#   headroom, detection moves back up
+class AdaptiveResolution:
+    def __init__(self, detector, budgetMs, maxLevel = 2, smoothing = 0.2, holdFrames = 15, headroom = 0.7):
+        self.detector = detector
+
+        # Target time per frame in milliseconds, and the smallest resolution allowed
+        self.budgetMs = budgetMs
+        self.maxLevel = maxLevel
+
+        # Rate at which the average frame time follows new frames
+        self.smoothing = smoothing
+
+        # Number of frames to wait after a change before changing again
+        self.holdFrames = holdFrames
+
+        # Fraction of the budget the predicted frame time has to fit in before moving to a larger level
+        self.headroom = headroom
+
+        self.averageMs = None
+        self.framesSinceChange = 0
+
+    # Move the detector to a new pyramid level and start measuring again
+    def SetLevel(self, level):
+        self.detector.SetPyramidLevel(level)
+        self.averageMs = None
+        self.framesSinceChange = 0
+
+    # known is passed on to the detector, which only uses it at pyramid level 0
+    def Process(self, img, known = None):
+        level = self.detector.pyramidLevel
+
+        # Time the detector
+        start = time.perf_counter()
+        result = self.detector.Process(img, known = known)
+        elapsedMs = (time.perf_counter() - start) * 1000
+        result['pyramidLevel'] = level
+
+        # Update the average frame time
+        if self.averageMs is None:
+            self.averageMs = elapsedMs
+        else:
+            self.averageMs = self.smoothing * elapsedMs + (1 - self.smoothing) * self.averageMs
+        self.framesSinceChange += 1
+
+        # Change level if needed
+        if self.framesSinceChange >= self.holdFrames:
+            if self.averageMs > self.budgetMs and level < self.maxLevel:
+                self.SetLevel(level + 1)
+            elif level > 0 and self.averageMs * 4 < self.budgetMs * self.headroom:
+                self.SetLevel(level - 1)
+
+        return result
+
+    def DrawOverlay(self, overlay, result, regions = None):
+        return self.detector.DrawOverlay(overlay, result, regions)
+
+    def ResultRow(self, result):
+        row = self.detector.ResultRow(result)
+        row['pyramidLevel'] = result['pyramidLevel']
+        return row
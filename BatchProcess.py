@@ -0,0 +1,252 @@
+# Headless batch processing of video files for EGR 530
+# Example: python BatchProcess.py videos/input2.mp4 --detector hough --output results --format csv
+
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Import helper functions file
+from HelperFunctions import *
+from LaneDetectors import HoughLaneDetector, BandLaneDetector
+from FrameStore import OpenVideo, StoreCapture, KnownFrames
+from StageTimer import StageTimer, nullTimer
+from AdaptiveResolution import AdaptiveResolution
+from LaneHistory import smootherTypes
+from OverlaySink import OverlaySink
+
+# Detectors that can be selected from the command line
+detectorTypes = {
+    'hough': HoughLaneDetector,
+    'bands': BandLaneDetector,
+}
+
+# Writes per-frame result rows to a CSV file (streamed) or a Parquet file (written on close)
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith('.parquet')
+        self.rows = []
+        self.file = None
+        self.writer = None
+
+        if self.parquet:
+            # Parquet output is optional, so only require pandas when it is used
+            try:
+                import pandas
+            except ImportError:
+                raise RuntimeError("Writing Parquet files requires pandas and pyarrow")
+            self.pandas = pandas
+
+    def Write(self, row):
+        if self.parquet:
+            self.rows.append(row)
+        else:
+            if self.writer is None:
+                self.file = open(self.path, 'w', newline = '')
+                self.writer = csv.DictWriter(self.file, fieldnames = list(row.keys()))
+                self.writer.writeheader()
+            self.writer.writerow(row)
+
+    def Close(self):
+        if self.parquet:
+            self.pandas.DataFrame(self.rows).to_parquet(self.path, index = False)
+        elif self.file is not None:
+            self.file.close()
+
+# Run a detector over every frame of a video, optionally writing an annotated copy of the video
+# Give the same timer to the detector to also time its stages
+def ProcessVideo(videoPath, detector, outputPath, annotatedPath = None, timer = nullTimer):
+    # Frames are decoded in a separate thread without dropping any, or read directly from a frame store folder
+    cap = OpenVideo(videoPath)
+    if not cap.isOpened():
+        raise IOError("Could not open video: " + videoPath)
+
+    writer = ResultWriter(outputPath)
+
+    # The annotated video is drawn and encoded in a separate thread, without dropping any frames
+    sink = None
+    if annotatedPath is not None:
+        sink = OverlaySink(detector, videoPath = annotatedPath, fps = cap.get(cv.CAP_PROP_FPS) or 30, mode = 'file',
+                           queueSize = 4, timer = timer, show = False)
+    frameIndex = 0
+    startTime = time.perf_counter()
+
+    try:
+        while True:
+            # Get current image
+            ret, img = cap.read()
+
+            # Stop at the end of the video
+            if not ret:
+                break
+
+            # Find lane lines, using the hsv and edges frames saved in a frame store if there are any
+            with timer.Stage('frame'):
+                result = detector.Process(img, known = KnownFrames(cap, detector))
+
+            # Save the results for this frame
+            with timer.Stage('write results'):
+                row = {'frame': frameIndex, 'timestamp': cap.get(cv.CAP_PROP_POS_MSEC)}
+                row.update(detector.ResultRow(result))
+                writer.Write(row)
+
+            # Only build the overlay if an annotated video was requested
+            if sink is not None:
+                sink.Submit(img, result)
+
+            frameIndex += 1
+    finally:
+        # Free up resources, rendering the queued frames before the capture is released
+        if sink is not None:
+            sink.Close()
+        cap.release()
+        writer.Close()
+
+    return frameIndex, time.perf_counter() - startTime
+
+# Sharded processing ###################################################################################################
+# Use a single OpenCV thread in each worker process, since the processes already use every core
+def InitShardWorker():
+    cv.setNumThreads(1)
+
+# Worker process: run a detector over frames [startFrame, endFrame) of a video, or to the end of the video if endFrame
+# is None
+# The detector state is warmed up on the warmupFrames frames before the shard, so the smoothed values match a serial run
+def ProcessShard(videoPath, detectorName, detectorArgs, startFrame, endFrame, warmupFrames):
+    detector = detectorTypes[detectorName](**detectorArgs)
+    firstFrame = max(0, startFrame - warmupFrames)
+
+    cap = OpenShardCapture(videoPath, firstFrame)
+
+    rows = []
+    try:
+        frameIndex = firstFrame
+        while endFrame is None or frameIndex < endFrame:
+            ret, img = cap.read()
+            if not ret:
+                break
+
+            # Find lane lines (results from warm-up frames are only used to update the detector state)
+            result = detector.Process(img, known = KnownFrames(cap, detector))
+            if frameIndex >= startFrame:
+                row = {'frame': frameIndex, 'timestamp': cap.get(cv.CAP_PROP_POS_MSEC)}
+                row.update(detector.ResultRow(result))
+                rows.append(row)
+            frameIndex += 1
+    finally:
+        cap.release()
+
+    return rows
+
+# Open a video positioned at a frame
+# Seeking is not frame accurate for many compressed (and variable frame rate) videos, so if the position read back
+# after seeking is not the requested frame, the video is opened again and read up to the frame instead
+def OpenShardCapture(videoPath, firstFrame):
+    cap = StoreCapture(videoPath) if os.path.isdir(videoPath) else cv.VideoCapture(videoPath)
+    if firstFrame == 0:
+        return cap
+
+    cap.set(cv.CAP_PROP_POS_FRAMES, firstFrame)
+    if int(cap.get(cv.CAP_PROP_POS_FRAMES)) == firstFrame:
+        return cap
+
+    cap.release()
+    cap = cv.VideoCapture(videoPath)
+    for _ in range(firstFrame):
+        if not cap.grab():
+            break
+    return cap
+
+# Split a video into frame ranges and process them in parallel, writing the merged results in frame order
+def ProcessVideoSharded(videoPath, detectorName, outputPath, workers, warmupFrames = 60, shards = None, detectorArgs = None):
+    # Get the number of frames in the video
+    # This is only an estimate for many videos, so it is only used to place the shard boundaries: the last shard runs to
+    # the end of the video, and the number of rows written is returned rather than the estimate
+    cap = StoreCapture(videoPath) if os.path.isdir(videoPath) else cv.VideoCapture(videoPath)
+    if not cap.isOpened():
+        raise IOError("Could not open video: " + videoPath)
+    frameCount = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    # Split the video into equal frame ranges
+    shards = shards or workers
+    bounds = np.linspace(0, frameCount, shards + 1).astype(int)
+    ranges = [(bounds[i], bounds[i + 1]) for i in range(shards) if bounds[i + 1] > bounds[i]]
+    ranges = ranges[:-1] + [(ranges[-1][0], None)] if ranges else [(0, None)]
+
+    startTime = time.perf_counter()
+    writer = ResultWriter(outputPath)
+    frames = 0
+    try:
+        with ProcessPoolExecutor(max_workers = workers, initializer = InitShardWorker) as pool:
+            futures = [pool.submit(ProcessShard, videoPath, detectorName, detectorArgs or {}, int(start), None if end is None else int(end), warmupFrames) for start, end in ranges]
+
+            # Shards are collected in order, so the rows are written in frame order
+            for future in futures:
+                for row in future.result():
+                    writer.Write(row)
+                    frames += 1
+    finally:
+        writer.Close()
+
+    return frames, time.perf_counter() - startTime
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Run lane detection over video files without a display")
+    parser.add_argument('videos', nargs = '+', help = "video files or frame store folders (FrameStore.py) to process")
+    parser.add_argument('--detector', choices = sorted(detectorTypes), default = 'hough', help = "hough (LaneAnnotation.py) or bands (LaneAnnotationV2.py)")
+    parser.add_argument('--output', default = '.', help = "directory for result files")
+    parser.add_argument('--format', choices = ['csv', 'parquet'], default = 'csv', help = "result file format")
+    parser.add_argument('--annotate', action = 'store_true', help = "also write a video with the lane overlay")
+    parser.add_argument('--workers', type = int, default = 1, help = "number of processes; more than 1 splits each video into frame ranges")
+    parser.add_argument('--warmup', type = int, default = 60, help = "frames before each range used to warm up the detector state")
+    parser.add_argument('--trace', action = 'store_true', help = "print stage timings and save a Chrome trace for each video")
+    parser.add_argument('--color-table', action = 'store_true', help = "isolate yellow and white with a precomputed lookup table (ColorLUT.py)")
+    parser.add_argument('--pyramid-level', type = int, default = 0, help = "run detection at 1/2^N of the full resolution")
+    parser.add_argument('--latency-budget', type = float, default = None, help = "change the pyramid level as needed to keep each frame within this many ms")
+    parser.add_argument('--tracking', action = 'store_true', help = "track the lane lines and only search narrow corridors around them (hough only, LaneTracking.py)")
+    parser.add_argument('--paths', nargs = '+', choices = ['G', 'GC'], default = None, help = "hough paths combined into the fused result (paths left out are not computed)")
+    parser.add_argument('--smoother', choices = smootherTypes, default = 'ema', help = "how lane coords are smoothed over time (LaneHistory.py)")
+    parser.add_argument('--smoothing-window', type = int, default = 5, help = "frames used by the median and outlier smoothers")
+    args = parser.parse_args()
+
+    if (args.tracking or args.paths) and args.detector != 'hough':
+        parser.error("--tracking and --paths are only supported with --detector hough")
+    if args.workers > 1 and (args.annotate or args.trace or args.latency_budget):
+        parser.error("--annotate, --trace and --latency-budget are only supported with --workers 1")
+
+    os.makedirs(args.output, exist_ok = True)
+
+    # Settings passed to every detector
+    detectorArgs = {'useColorTable': args.color_table, 'pyramidLevel': args.pyramid_level,
+                    'smoother': args.smoother, 'smoothingWindow': args.smoothing_window}
+    if args.tracking:
+        detectorArgs['tracking'] = True
+    if args.paths:
+        detectorArgs['paths'] = tuple(args.paths)
+
+    for videoPath in args.videos:
+        name = os.path.splitext(os.path.basename(os.path.normpath(videoPath)))[0]
+        outputPath = os.path.join(args.output, name + '.' + args.format)
+        annotatedPath = os.path.join(args.output, name + '_annotated.mp4') if args.annotate else None
+
+        if args.workers > 1:
+            frames, elapsed = ProcessVideoSharded(videoPath, args.detector, outputPath, args.workers, args.warmup, detectorArgs = detectorArgs)
+        else:
+            # Each video starts with a fresh detector
+            timer = StageTimer(args.trace, window = 100000)
+            detector = detectorTypes[args.detector](timer = timer, **detectorArgs)
+            if args.latency_budget:
+                detector = AdaptiveResolution(detector, args.latency_budget)
+            frames, elapsed = ProcessVideo(videoPath, detector, outputPath, annotatedPath, timer)
+
+            if args.trace:
+                for stage, stats in timer.Stats().items():
+                    print("  {:<16} mean {:>7.2f} ms   p95 {:>7.2f} ms   max {:>7.2f} ms".format(stage, stats['mean'], stats['p95'], stats['max']))
+                timer.ExportChromeTrace(os.path.join(args.output, name + '_trace.json'))
+        print(videoPath + ": " + str(frames) + " frames in " + str(round(elapsed, 2)) + " s (" + str(round(frames / max(elapsed, 1e-9), 1)) + " fps) -> " + outputPath)
+
+if __name__ == '__main__':
+    Main()
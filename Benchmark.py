@@ -0,0 +1,202 @@
+# Per-stage benchmark for EGR 530
+# Times each stage of the lane detection pipeline on synthetic road frames and/or the bundled test images
+# Example: python Benchmark.py --resolutions 640x360 1280x720 --images --output bench.json
+#          python Benchmark.py --output new.json --compare bench.json
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+# Import helper functions file
+from HelperFunctions import *
+from LaneDetectors import HoughLaneDetector, BandLaneDetector
+from SyntheticFrames import GenerateRoadSequence
+from ColorLUT import LoadColorTable, ApplyColorTable
+from OverlaySink import OverlayRenderer
+
+# Stages #############################################################################################################
+# Each stage has a prepare function, which builds the inputs for one frame outside of the timed region,
+# and a run function, which is the part that gets timed
+
+# Isolate yellow and white the same way as the detectors
+def RecolorFrame(img):
+    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
+    img_yellow = cv.inRange(img_hsv, (20, 39, 64), (35, 255, 255))
+    img_white = cv.inRange(img_hsv, (0, 0, 229), (180, 38, 255))
+    return img_yellow + img_white
+
+# Find lane lines without raising if none are found
+def RunHough(img_edges_crop):
+    try:
+        return FindLaneLinesHough(img_edges_crop, 0.25, 1)
+    except ValueError:
+        return None
+
+# Fit a line in the first left-hand measurement band of LaneAnnotationV2.py
+def RunLineFit(img_band, offset, height):
+    try:
+        return FindLaneLineFit(img_band, np.zeros(4), 0.66, 0.7, offset, height)
+    except IndexError:
+        return None
+
+# Fit lines in every band of LaneAnnotationV2.py at once, with the band windows of a new detector
+def PrepareBandFit(img):
+    bandTops, bandBottoms, windows = BandLaneDetector().BandWindows(img.shape[1])
+    return DetectEdges(RecolorFrame(img)), bandTops, bandBottoms, windows
+
+# Build and blend the full overlay of the Hough detector
+def RunOverlay(img, detector, result):
+    overlay = InitOverlay(img)
+    detector.DrawOverlay(overlay, result)
+    return AddOverlay(img, overlay)
+
+# Build the stages for a set of frames
+# Returns a list of (stage name, prepare function, run function)
+def BuildStages(frames):
+    houghDetector = HoughLaneDetector()
+    houghResult = houghDetector.Process(frames[0])
+
+    # Overlay that is only cleared and blended where it was drawn on, reused between calls like in OverlaySink.py
+    overlayRenderer = OverlayRenderer(houghDetector.DrawOverlay)
+
+    # Detectors used for end-to-end timings, which keep their state between frames
+    endToEnd = {'hough': HoughLaneDetector(), 'bands': BandLaneDetector()}
+
+    # Color table for the same thresholds as RecolorFrame
+    colorTable = LoadColorTable(((20, 39, 64), (35, 255, 255)), ((0, 0, 229), (180, 38, 255)))
+
+    return [
+        ('recolor', lambda img: (img,), RecolorFrame),
+        ('recolor color table', lambda img: (img, colorTable, np.empty(img.shape[:2], np.uint8), np.empty(img.shape[:2] + (4,), np.uint8)), ApplyColorTable),
+        ('DetectEdges', lambda img: (img,), DetectEdges),
+        ('TriangularMask', lambda img: (DetectEdges(img), 0.25, 0.9), TriangularMask),
+        ('RectangularMask', lambda img: (DetectEdges(img), 0.66, 0.7, 0.0, 0.48, 0.01, -0.005), RectangularMask),
+        ('RectangularMaskLocal', lambda img: (DetectEdges(img), 0.66, 0.7, 0.0, 0.48, 0.01, -0.005), RectangularMaskLocal),
+        ('FindLaneLinesHough', lambda img: (TriangularMask(DetectEdges(img), 0.25, 0.9)[0],), RunHough),
+        ('FindLaneLineFit', lambda img: RectangularMaskLocal(DetectEdges(RecolorFrame(img)), 0.66, 0.7, 0.0, 0.48, 0.01, -0.005)[0::2] + (img.shape[0],), RunLineFit),
+        ('FitBandLines', PrepareBandFit, FitBandLines),
+        ('overlay', lambda img: (img, houghDetector, houghResult), RunOverlay),
+        ('overlay regions', lambda img: (img, houghResult), overlayRenderer.Render),
+        ('end-to-end hough', lambda img: (img,), endToEnd['hough'].Process),
+        ('end-to-end bands', lambda img: (img,), endToEnd['bands'].Process),
+    ]
+
+# Timing ###############################################################################################################
+# Summarize a list of per-call times in seconds
+def LatencyStats(times):
+    times = np.asarray(times)
+    return {
+        'calls': int(len(times)),
+        'fps': float(1 / np.mean(times)) if np.mean(times) > 0 else float('inf'),
+        'mean_ms': float(np.mean(times) * 1000),
+        'p50_ms': float(np.percentile(times, 50) * 1000),
+        'p95_ms': float(np.percentile(times, 95) * 1000),
+        'p99_ms': float(np.percentile(times, 99) * 1000),
+    }
+
+# Time every stage over a set of frames, repeating the set until minCalls calls have been made
+def BenchmarkFrames(sourceName, frames, minCalls = 100, stageFilter = None):
+    results = []
+    for name, prepare, run in BuildStages(frames):
+        if stageFilter and not any(f in name for f in stageFilter):
+            continue
+
+        inputs = [prepare(img) for img in frames]
+
+        # One untimed call to warm up caches
+        run(*inputs[0])
+
+        times = []
+        while len(times) < minCalls:
+            for args in inputs:
+                start = time.perf_counter()
+                run(*args)
+                times.append(time.perf_counter() - start)
+
+        row = {'source': sourceName, 'stage': name}
+        row.update(LatencyStats(times))
+        results.append(row)
+        print("{:<28} {:<24} {:>9.1f} fps   p50 {:>7.2f} ms   p95 {:>7.2f} ms   p99 {:>7.2f} ms".format(
+            sourceName, name, row['fps'], row['p50_ms'], row['p95_ms'], row['p99_ms']))
+    return results
+
+# Compare two sets of results and print the change in mean latency for each stage
+def CompareResults(results, baseline, threshold = 0.1):
+    old = {(r['source'], r['stage']): r for r in baseline['results']}
+    regressions = 0
+    for r in results:
+        key = (r['source'], r['stage'])
+        if key not in old:
+            continue
+        change = r['mean_ms'] / old[key]['mean_ms'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print("{:<28} {:<24} {:>+7.1f}%{}".format(key[0], key[1], change * 100, flag))
+    return regressions
+
+def ParseResolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Benchmark each stage of the lane detection pipeline")
+    parser.add_argument('--resolutions', nargs = '*', default = ['640x360', '1280x720', '1920x1080'], help = "synthetic frame sizes, as WIDTHxHEIGHT")
+    parser.add_argument('--frames', type = int, default = 30, help = "synthetic frames per resolution")
+    parser.add_argument('--calls', type = int, default = 100, help = "minimum timed calls per stage")
+    parser.add_argument('--images', nargs = '*', default = None, help = "also time these images (default with no paths: lane-detection-test-*.png)")
+    parser.add_argument('--stages', nargs = '*', default = None, help = "only run stages whose names contain one of these strings")
+    parser.add_argument('--output', default = None, help = "save results to this JSON file")
+    parser.add_argument('--compare', default = None, help = "compare against a previous JSON file")
+    parser.add_argument('--threshold', type = float, default = 0.1, help = "slowdown that counts as a regression when comparing")
+    args = parser.parse_args()
+
+    results = []
+
+    # Synthetic road frames at each resolution
+    for resolution in args.resolutions:
+        width, height = ParseResolution(resolution)
+        frames = GenerateRoadSequence(args.frames, width, height)
+        results += BenchmarkFrames('synthetic-' + resolution, frames, args.calls, args.stages)
+
+    # Bundled test images
+    if args.images is not None:
+        paths = args.images or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lane-detection-test-*.png')))
+        for path in paths:
+            img = cv.imread(path)
+            if img is None:
+                print("Could not read image: " + path)
+                continue
+            results += BenchmarkFrames(os.path.basename(path), [img], args.calls, args.stages)
+
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'opencv': cv.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = CompareResults(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    Main()
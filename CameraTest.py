@@ -1,11 +1,15 @@
 import numpy as np
 import cv2
+from FrameCapture import ThreadedCapture
 
-cap = cv2.VideoCapture(0)
+# Frames are read in a separate thread, dropping old frames if the loop falls behind
+cap = ThreadedCapture(0)
 
 while(True):
     # Capture frame-by-frame
     ret, frame = cap.read()
+    if not ret:
+        break
 
     # Our operations on the frame come here
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
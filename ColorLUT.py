@@ -0,0 +1,154 @@
+# Color lookup table for EGR 530
+# The yellow/white thresholds are fixed, so whether a pixel is a lane color only depends on its BGR value. This builds a
+# table with the answer for every 24 bit color once, so a frame can be recolored with a single lookup per pixel instead
+# of an HSV conversion, two range tests, and an add
+# Run this file to benchmark the table against the HSV path and check that the results are identical
+
+import argparse
+import glob
+import hashlib
+import os
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+# Folder where built tables are saved (bit-packed, 2 MB each)
+tableCacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'egr530-lane-detection')
+
+# Tables already loaded in this process, keyed on threshold set
+loadedTables = {}
+
+# Build the table for a pair of HSV ranges
+# Entry B | G << 8 | R << 16 is 255 if that color is yellow or white, and 0 otherwise
+def BuildColorTable(yellowRange, whiteRange):
+    # Every 24 bit color, laid out as a 4096x4096 image in table order
+    colors = np.arange(1 << 24, dtype = np.uint32).reshape(4096, 4096)
+    img = np.empty((4096, 4096, 3), dtype = np.uint8)
+    img[:, :, 0] = colors & 0xFF
+    img[:, :, 1] = (colors >> 8) & 0xFF
+    img[:, :, 2] = colors >> 16
+
+    # Classify every color exactly the same way as the detectors do
+    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
+    img_yellow = cv.inRange(img_hsv, yellowRange[0], yellowRange[1])
+    img_white = cv.inRange(img_hsv, whiteRange[0], whiteRange[1])
+    return (img_yellow + img_white).reshape(-1)
+
+# Get the file a table is saved in, named after its thresholds
+def ColorTablePath(yellowRange, whiteRange, cacheDir = tableCacheDir):
+    key = repr((tuple(map(tuple, yellowRange)), tuple(map(tuple, whiteRange))))
+    return os.path.join(cacheDir, 'colortable-' + hashlib.sha1(key.encode()).hexdigest()[:16] + '.npy')
+
+# Get the table for a pair of HSV ranges, loading it from disk or building and saving it if needed
+def LoadColorTable(yellowRange, whiteRange, cacheDir = tableCacheDir):
+    key = (tuple(map(tuple, yellowRange)), tuple(map(tuple, whiteRange)))
+    table = loadedTables.get(key)
+    if table is not None:
+        return table
+
+    path = ColorTablePath(yellowRange, whiteRange, cacheDir)
+    table = ReadColorTable(path)
+    if table is None:
+        table = BuildColorTable(yellowRange, whiteRange)
+        SaveColorTable(path, table)
+
+    loadedTables[key] = table
+    return table
+
+# Read a saved table, or return None if there isn't a complete one (a failed read is treated as a cache miss)
+def ReadColorTable(path):
+    try:
+        packed = np.load(path)
+    except (OSError, ValueError, EOFError):
+        return None
+    # Tables are saved as one bit per color
+    if packed.dtype != np.uint8 or packed.shape != ((1 << 24) // 8,):
+        return None
+    return np.unpackbits(packed) * np.uint8(255)
+
+# Save a table as one bit per color
+# Several processes can build the same table at once (shards, sweeps, the service), so the table is written to a
+# temporary file and moved into place, and a reader never sees a partly written file
+def SaveColorTable(path, table):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tempPath = tempfile.mkstemp(dir = os.path.dirname(path), suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.packbits(table > 0))
+            os.replace(tempPath, path)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
+    except OSError:
+        # The table still works if it can't be saved, it just has to be built again next time
+        pass
+
+# Recolor a frame with a color table, giving 255 for yellow or white pixels and 0 otherwise
+# Pass dst (single channel) and scratch (4 channel) to reuse existing arrays
+def ApplyColorTable(img, table, dst = None, scratch = None):
+    # Pack each pixel into 32 bits (B | G << 8 | R << 16) by adding a zero fourth channel
+    scratch = cv.cvtColor(img, cv.COLOR_BGR2BGRA, dst = scratch)
+    cv.bitwise_and(scratch, (255, 255, 255, 0), dst = scratch)
+    index = scratch.view(np.uint32).reshape(img.shape[:2])
+
+    # Look up every pixel in one pass
+    if dst is None:
+        dst = np.empty(img.shape[:2], dtype = np.uint8)
+    return np.take(table, index, out = dst)
+
+# Benchmark ############################################################################################################
+# Recolor a frame the way the detectors do without a table
+def RecolorHSV(img, yellowRange, whiteRange):
+    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
+    img_yellow = cv.inRange(img_hsv, yellowRange[0], yellowRange[1])
+    img_white = cv.inRange(img_hsv, whiteRange[0], whiteRange[1])
+    return img_yellow + img_white
+
+# Time a function, returning the mean time in milliseconds
+def TimeCall(function, calls):
+    function()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1000
+
+def Main():
+    from SyntheticFrames import GenerateRoadFrame
+
+    parser = argparse.ArgumentParser(description = "Benchmark the color table against HSV conversion and check parity")
+    parser.add_argument('--calls', type = int, default = 50, help = "timed calls per frame")
+    args = parser.parse_args()
+
+    # Threshold sets from LaneAnnotation.py and LaneAnnotationV2.py
+    thresholdSets = {
+        'hough': (((20, 39, 64), (35, 255, 255)), ((0, 0, 229), (180, 38, 255))),
+        'bands': (((16, 39, 64), (35, 255, 255)), ((0, 0, 215), (180, 20, 255))),
+    }
+
+    # Synthetic frames at several resolutions plus the bundled test images
+    frames = []
+    for width, height in ((640, 360), (1280, 720), (1920, 1080)):
+        frames.append(('synthetic-' + str(width) + 'x' + str(height), GenerateRoadFrame(width, height, 3, curvature = 0.1)[0]))
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.png'))):
+        frames.append((os.path.basename(path), cv.imread(path)))
+
+    for setName, (yellowRange, whiteRange) in thresholdSets.items():
+        start = time.perf_counter()
+        table = LoadColorTable(yellowRange, whiteRange)
+        print(setName + " table ready in " + str(round(time.perf_counter() - start, 2)) + " s (" + ColorTablePath(yellowRange, whiteRange) + ")")
+
+        for name, img in frames:
+            dst = np.empty(img.shape[:2], dtype = np.uint8)
+            scratch = np.empty(img.shape[:2] + (4,), dtype = np.uint8)
+
+            mismatches = np.count_nonzero(ApplyColorTable(img, table, dst, scratch) != RecolorHSV(img, yellowRange, whiteRange))
+            hsvTime = TimeCall(lambda: RecolorHSV(img, yellowRange, whiteRange), args.calls)
+            tableTime = TimeCall(lambda: ApplyColorTable(img, table, dst, scratch), args.calls)
+            print("  {:<40} hsv {:>6.2f} ms   table {:>6.2f} ms   speedup {:>5.2f}x   mismatched pixels {}".format(
+                name, hsvTime, tableTime, hsvTime / tableTime, mismatches))
+
+if __name__ == '__main__':
+    Main()
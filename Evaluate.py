@@ -0,0 +1,274 @@
+# Speed and accuracy evaluation for EGR 530
+# Runs detector configurations on annotated frames and reports how far their lane lines and steering values are from
+# the annotations, along with their speed, so faster modes can be checked against an accuracy tolerance
+# Annotations (lane-annotations.json) give each lane line as a list of [x, y] points in image coords, or null if the
+# line can't be seen, with an optional [x, y, width, height] crop for screenshots:
+#   {"images": [{"image": "lane-detection-test-3.png", "crop": null, "left": [[257, 560], [455, 440]], "right": ...}]}
+# Example: python Evaluate.py
+#          python Evaluate.py --synthetic 20 --configs configs.json --baseline hough-fused --output evaluation.csv
+# where configs.json replaces defaultConfigs and has to include the baseline:
+#   {"hough-fused": {"detector": "hough"}, "bands-6": {"detector": "bands", "measurementBands": 6}}
+
+import argparse
+import json
+import os
+import time
+
+# Import helper functions file
+from HelperFunctions import *
+from LaneDetectors import HoughLaneDetector
+from BatchProcess import ResultWriter, detectorTypes
+
+# Configurations evaluated when none are given, as name: detector and constructor arguments
+defaultConfigs = {
+    'hough-G': {'detector': 'hough', 'paths': ['G']},
+    'hough-GC': {'detector': 'hough', 'paths': ['GC']},
+    'hough-fused': {'detector': 'hough'},
+    'hough-fused-half': {'detector': 'hough', 'pyramidLevel': 1},
+    'hough-fused-quarter': {'detector': 'hough', 'pyramidLevel': 2},
+    'bands-18': {'detector': 'bands'},
+    'bands-12': {'detector': 'bands', 'measurementBands': 12},
+    'bands-8': {'detector': 'bands', 'measurementBands': 8},
+    'bands-18-half': {'detector': 'bands', 'pyramidLevel': 1},
+}
+
+# Samples ##############################################################################################################
+# Load the annotated frames, as a list of (name, frame, [left points, right points]) with points in frame coords
+def LoadAnnotations(path):
+    with open(path) as f:
+        annotations = json.load(f)
+    folder = os.path.dirname(os.path.abspath(path))
+
+    samples = []
+    for entry in annotations['images']:
+        img = cv.imread(os.path.join(folder, entry['image']))
+        if img is None:
+            raise IOError("Could not read image: " + entry['image'])
+
+        # Cut screenshots down to the video area, and move the points with it
+        x, y = 0, 0
+        if entry.get('crop'):
+            x, y, width, height = entry['crop']
+            img = img[y:y + height, x:x + width]
+
+        lanes = []
+        for side in ('left', 'right'):
+            points = entry.get(side)
+            lanes.append(None if points is None else np.array(points, dtype = np.float64) - (x, y))
+        samples.append((entry['image'], np.ascontiguousarray(img), lanes))
+    return samples
+
+# Synthetic road frames (SyntheticFrames.py) with their exact lane lines, on roads of different curvature and offset
+def SyntheticSamples(count):
+    from SyntheticFrames import GenerateRoadFrame
+
+    samples = []
+    for i in range(count):
+        curvature = 0.15 * np.sin(2 * np.pi * i / max(count, 1))
+        offset = 0.05 * np.cos(2 * np.pi * i / max(count, 1))
+        img, lanePoints = GenerateRoadFrame(frameIndex = i, seed = 1, curvature = curvature, offset = offset)
+        samples.append(('synthetic:' + str(i), img, [lanePoints[0], lanePoints[1]]))
+    return samples
+
+# Get the x coords of an annotated lane line at rows ys
+# Rows outside the annotated points are extended along the end segments if extend is True, and NaN otherwise
+def LaneX(points, ys, extend = False):
+    points = points[np.argsort(points[:, 1])]
+    xs = np.interp(ys, points[:, 1], points[:, 0])
+    top, bottom = points[0], points[-1]
+    if extend:
+        topSlope = (points[1, 0] - top[0]) / (points[1, 1] - top[1])
+        bottomSlope = (bottom[0] - points[-2, 0]) / (bottom[1] - points[-2, 1])
+        xs = np.where(ys < top[1], top[0] + (ys - top[1]) * topSlope, xs)
+        xs = np.where(ys > bottom[1], bottom[0] + (ys - bottom[1]) * bottomSlope, xs)
+    else:
+        xs = np.where((ys < top[1]) | (ys > bottom[1]), np.nan, xs)
+    return xs
+
+# Metrics ##############################################################################################################
+# Lines of a result as (lines, 2 sides, x1/y1/x2/y2), the steering value, and which lines the steering value is made from
+def ResultLines(detector, result):
+    if isinstance(detector, HoughLaneDetector):
+        return np.asarray(result['laneCoordsCombined'], dtype = np.float64)[None], result['steeringValueCombined'], slice(None)
+    steeringBands = slice(detector.testBandMin, detector.testBandMax + 1)
+    return np.asarray(result['laneCoords'], dtype = np.float64), result['steeringValue'], steeringBands
+
+# Average distance between each line and the annotated lane line on its side, over the rows they both cover, as a
+# fraction of the frame width. Sides with no annotation are left out, and sides with no line covering the annotated
+# rows count as missed. Returns (error, sides found, sides annotated)
+def LaneError(lines, lanes, width, rows = 10):
+    errors = []
+    found = 0
+    annotated = 0
+    for side in (0, 1):
+        if lanes[side] is None:
+            continue
+        annotated += 1
+
+        sideErrors = []
+        for x1, y1, x2, y2 in lines[:, side]:
+            if y1 == y2:
+                continue
+            ys = np.linspace(min(y1, y2), max(y1, y2), rows)
+            lineX = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+            difference = np.abs(lineX - LaneX(lanes[side], ys))
+            if not np.isnan(difference).all():
+                sideErrors.append(np.nanmean(difference))
+        if sideErrors:
+            found += 1
+            errors.append(np.mean(sideErrors) / width)
+
+    return (np.mean(errors) if errors else np.nan), found, annotated
+
+# Steering value the detector would have given if its lines matched the annotations exactly: the same calculation from
+# the annotated lane lines at the rows of the detector's lines (NaN unless both sides are annotated)
+# A side whose lines were never found has no rows of its own, so the rows of the other side are used for it
+def ReferenceSteering(lines, lanes, width):
+    if lanes[0] is None or lanes[1] is None:
+        return np.nan
+    rows = [lines[:, side, [1, 3]] for side in (0, 1)]
+    valid = [(r[:, 0] != r[:, 1]).any() for r in rows]
+    if not (valid[0] or valid[1]):
+        return np.nan
+
+    centers = []
+    for side in (0, 1):
+        ys = rows[side] if valid[side] else rows[1 - side]
+        centers.append(np.mean(LaneX(lanes[side], ys.ravel(), extend = True)) / width)
+    return (centers[0] + centers[1]) / 2
+
+# Evaluation ###########################################################################################################
+# Run a configuration on every sample and return a row of metrics for each
+# Each sample is a single frame, so a fresh detector is given the frame warmup times first to let the lane coords settle
+# (they move towards each new measurement at laneUpdateRate), then timed over frames more
+def EvaluateConfig(name, config, samples, warmup = 60, frames = 10):
+    options = dict(config)
+    detectorName = options.pop('detector')
+    rows = []
+    for sampleName, img, lanes in samples:
+        detector = detectorTypes[detectorName](**options)
+        for _ in range(warmup):
+            detector.Process(img)
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            result = detector.Process(img)
+        elapsed = time.perf_counter() - start
+
+        width = img.shape[1]
+        lines, steering, steeringBands = ResultLines(detector, result)
+        laneError, found, annotated = LaneError(lines, lanes, width)
+        reference = ReferenceSteering(lines[steeringBands], lanes, width)
+        rows.append({
+            'config': name,
+            'sample': sampleName,
+            'lane_error': laneError,
+            'steering': steering,
+            'steering_reference': reference,
+            'steering_error': abs(steering - reference),
+            'sides_found': found,
+            'sides_annotated': annotated,
+            'ms_per_frame': elapsed / frames * 1000,
+        })
+    return rows
+
+# Combine the rows of each configuration
+def SummarizeConfigs(rows):
+    summaries = []
+    for name in dict.fromkeys(row['config'] for row in rows):
+        configRows = [row for row in rows if row['config'] == name]
+        annotated = sum(row['sides_annotated'] for row in configRows)
+        milliseconds = np.mean([row['ms_per_frame'] for row in configRows])
+        laneErrors = [row['lane_error'] for row in configRows if not np.isnan(row['lane_error'])]
+        steeringErrors = [row['steering_error'] for row in configRows if not np.isnan(row['steering_error'])]
+        summaries.append({
+            'config': name,
+            'fps': 1000 / milliseconds if milliseconds > 0 else float('inf'),
+            'lane_error': np.mean(laneErrors) if laneErrors else np.nan,
+            'steering_error': np.mean(steeringErrors) if steeringErrors else np.nan,
+            'found': sum(row['sides_found'] for row in configRows) / annotated if annotated else 0.0,
+        })
+    return summaries
+
+# Mark each configuration that no other configuration beats on both speed and lane error
+# Configurations with no lane error (no annotated line found on any sample) count as infinitely wrong, and are never on
+# the front
+def MarkParetoFront(summaries):
+    errors = [np.inf if np.isnan(s['lane_error']) else s['lane_error'] for s in summaries]
+    for s, error in zip(summaries, errors):
+        s['pareto'] = not np.isinf(error) and not any(o is not s and o['fps'] >= s['fps'] and oError <= error and
+                                                      (o['fps'] > s['fps'] or oError < error) for o, oError in zip(summaries, errors))
+
+# Mark each configuration that is within tolerance of the baseline: lane and steering errors at most the tolerances
+# above the baseline's, and a fraction of lines found at most foundTolerance below it
+# Without a baseline, the tolerances are absolute (compared with a perfect detector)
+def MarkWithinTolerance(summaries, baseline, tolerance, steeringTolerance, foundTolerance):
+    reference = {'lane_error': 0.0, 'steering_error': 0.0, 'found': 1.0}
+    if baseline:
+        reference = next(s for s in summaries if s['config'] == baseline)
+    for s in summaries:
+        s['ok'] = (s['lane_error'] <= reference['lane_error'] + tolerance and
+                   s['steering_error'] <= reference['steering_error'] + steeringTolerance and
+                   s['found'] >= reference['found'] - foundTolerance)
+    return reference
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Compare the speed and accuracy of detector configurations on annotated frames")
+    parser.add_argument('--annotations', default = 'lane-annotations.json', help = "annotation file (empty to use only synthetic frames)")
+    parser.add_argument('--synthetic', type = int, default = 0, help = "also evaluate on this many synthetic road frames")
+    parser.add_argument('--configs', default = None, help = "JSON file of name: {\"detector\": \"hough\" or \"bands\", constructor arguments...}")
+    parser.add_argument('--warmup', type = int, default = 60, help = "frames run on each sample before measuring")
+    parser.add_argument('--frames', type = int, default = 10, help = "frames timed on each sample")
+    parser.add_argument('--baseline', default = 'hough-fused', help = "configuration the others are compared with (empty to use absolute tolerances)")
+    parser.add_argument('--tolerance', type = float, default = 0.01, help = "largest lane error allowed above the baseline's, as a fraction of the frame width")
+    parser.add_argument('--steering-tolerance', type = float, default = 0.02, help = "largest steering error allowed above the baseline's")
+    parser.add_argument('--found-tolerance', type = float, default = 0.1, help = "largest drop allowed in the fraction of annotated lines found, below the baseline's")
+    parser.add_argument('--output', default = None, help = "save one row per configuration and sample to this CSV or Parquet file")
+    args = parser.parse_args()
+
+    samples = LoadAnnotations(args.annotations) if args.annotations else []
+    samples += SyntheticSamples(args.synthetic)
+    if not samples:
+        parser.error("no samples to evaluate")
+
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    else:
+        configs = defaultConfigs
+    if args.baseline and args.baseline not in configs:
+        parser.error("baseline configuration not found: " + args.baseline)
+
+    rows = []
+    for name, config in configs.items():
+        rows += EvaluateConfig(name, config, samples, args.warmup, args.frames)
+
+    if args.output:
+        writer = ResultWriter(args.output)
+        for row in rows:
+            writer.Write(row)
+        writer.Close()
+
+    summaries = SummarizeConfigs(rows)
+    MarkParetoFront(summaries)
+    reference = MarkWithinTolerance(summaries, args.baseline, args.tolerance, args.steering_tolerance, args.found_tolerance)
+
+    # Fastest first, with the Pareto front marked with * and configurations within tolerance marked ok
+    summaries.sort(key = lambda s: -s['fps'])
+    print("{} samples, tolerance{}: lane error {:.1f}% of width, steering error {:.4f}, {:.0f}% of lines found".format(
+        len(samples), " (baseline " + args.baseline + " + margins)" if args.baseline else "",
+        (reference['lane_error'] + args.tolerance) * 100, reference['steering_error'] + args.steering_tolerance,
+        (reference['found'] - args.found_tolerance) * 100))
+    print("{:<22} {:>8} {:>11} {:>15} {:>7}  {:>6}  {}".format('config', 'fps', 'lane error', 'steering error', 'found', 'pareto', 'within tolerance'))
+    for s in summaries:
+        print("{:<22} {:>8.1f} {:>10.2f}% {:>15.4f} {:>6.0f}%  {:>6}  {}".format(
+            s['config'], s['fps'], s['lane_error'] * 100, s['steering_error'], s['found'] * 100, '*' if s['pareto'] else '', 'ok' if s['ok'] else ''))
+
+    fastest = next((s for s in summaries if s['ok']), None)
+    if fastest is not None:
+        print("Fastest configuration within tolerance: " + fastest['config'])
+    else:
+        print("No configuration is within tolerance")
+
+if __name__ == '__main__':
+    Main()
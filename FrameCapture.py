@@ -0,0 +1,187 @@
+# Threaded frame capture for EGR 530
+# Decodes frames in a background thread so decoding overlaps with detection
+
+import queue
+import threading
+import time
+
+import cv2 as cv
+
+# Reads frames from a cv.VideoCapture in a separate thread and passes them on through a bounded queue
+# Has the same read/isOpened/get/release interface as cv.VideoCapture, so it can replace it directly
+# Modes:
+#  - 'live' - if detection falls behind, the oldest queued frame is dropped so latency stays bounded (cameras)
+#  - 'file' - frames are never dropped; the capture thread waits for space in the queue (video files)
+class ThreadedCapture:
+    def __init__(self, source, mode = None, queueSize = 4):
+        # Accept either an existing capture object or anything cv.VideoCapture can open
+        if hasattr(source, 'read'):
+            self.cap = source
+        else:
+            self.cap = cv.VideoCapture(source)
+
+        # Cameras are given as device numbers, everything else is treated as a file
+        if mode is None:
+            mode = 'live' if isinstance(source, int) else 'file'
+        if mode not in ('live', 'file'):
+            raise ValueError("Unknown capture mode: " + str(mode))
+        self.mode = mode
+
+        self.frames = queue.Queue(maxsize = max(1, queueSize))
+        self.stopped = threading.Event()
+        self.ended = False
+
+        # Number of frames dropped in live mode, and the position of the last frame returned by read()
+        self.droppedFrames = 0
+        self.framesRead = 0
+        self.timestamp = 0.0
+
+        # Time (time.perf_counter) the last frame returned by read() was decoded, for measuring latency
+        self.arrivalTime = None
+
+        self.thread = threading.Thread(target = self.CaptureLoop, daemon = True)
+        if self.cap.isOpened():
+            self.thread.start()
+        else:
+            self.ended = True
+
+    # Background thread: decode frames until the end of the stream or until released
+    def CaptureLoop(self):
+        while not self.stopped.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self.Put((frame, self.cap.get(cv.CAP_PROP_POS_MSEC), time.perf_counter()))
+
+        # Mark the end of the stream
+        self.Put(None)
+
+    # Add an item to the queue using the drop policy for the current mode
+    def Put(self, item):
+        while not self.stopped.is_set():
+            if self.mode == 'file':
+                try:
+                    self.frames.put(item, timeout = 0.1)
+                    return
+                except queue.Full:
+                    continue
+            else:
+                try:
+                    self.frames.put_nowait(item)
+                    return
+                except queue.Full:
+                    # Drop the oldest frame to make room for the new one
+                    try:
+                        if self.frames.get_nowait() is not None:
+                            self.droppedFrames += 1
+                    except queue.Empty:
+                        pass
+
+    # Get the next frame, waiting for the capture thread if needed
+    def read(self):
+        if self.ended:
+            return False, None
+        return self.Unpack(self.frames.get())
+
+    # Get the next frame only if one is ready, without waiting
+    # Returns the same as read(), or None if the capture thread hasn't decoded another frame yet
+    def poll(self):
+        if self.ended:
+            return False, None
+        try:
+            item = self.frames.get_nowait()
+        except queue.Empty:
+            return None
+        return self.Unpack(item)
+
+    def Unpack(self, item):
+        if item is None:
+            self.ended = True
+            return False, None
+        frame, self.timestamp, self.arrivalTime = item
+        self.framesRead += 1
+        return True, frame
+
+    def isOpened(self):
+        return not self.ended
+
+    # Properties that depend on the read position refer to the last frame returned by read()
+    def get(self, propId):
+        if propId == cv.CAP_PROP_POS_MSEC:
+            return self.timestamp
+        if propId == cv.CAP_PROP_POS_FRAMES:
+            return self.framesRead
+        return self.cap.get(propId)
+
+    # Stop the capture thread and free up resources
+    def release(self):
+        self.stopped.set()
+        self.ended = True
+
+        # Empty the queue so the capture thread is not left waiting
+        while self.thread.is_alive():
+            try:
+                self.frames.get(timeout = 0.01)
+            except queue.Empty:
+                pass
+        self.cap.release()
+
+# Replays a video file like a camera, at its native frame rate (or a given one), for testing live processing
+# Has the same read/isOpened/get/release interface as cv.VideoCapture. read() waits until the next frame is due, and
+# frames that are already late (if decoding can't keep up) are skipped the way a camera would, without decoding them
+class ReplayCapture:
+    def __init__(self, source, fps = None, loop = False):
+        self.cap = source if hasattr(source, 'read') else cv.VideoCapture(source)
+        self.fps = fps or self.cap.get(cv.CAP_PROP_FPS) or 30
+
+        # Start again from the first frame at the end of the file
+        self.loop = loop
+
+        # Frames skipped because they were late, and the number of frames since the start (including skipped frames)
+        self.skippedFrames = 0
+        self.frameIndex = 0
+        self.startTime = None
+
+    def read(self):
+        if self.startTime is None:
+            self.startTime = time.perf_counter()
+
+        # Skip frames that were due more than a frame ago
+        while time.perf_counter() - self.startTime > (self.frameIndex + 1) / self.fps:
+            if not self.Grab():
+                return False, None
+            self.skippedFrames += 1
+
+        # Wait until the next frame is due
+        wait = self.startTime + self.frameIndex / self.fps - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+
+        ret, frame = self.cap.read()
+        if not ret and self.loop and self.Rewind():
+            ret, frame = self.cap.read()
+        if ret:
+            self.frameIndex += 1
+        return ret, frame
+
+    # Move past the next frame without decoding it
+    def Grab(self):
+        if not self.cap.grab():
+            if not (self.loop and self.Rewind() and self.cap.grab()):
+                return False
+        self.frameIndex += 1
+        return True
+
+    def Rewind(self):
+        return self.cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, propId):
+        if propId == cv.CAP_PROP_FPS:
+            return self.fps
+        return self.cap.get(propId)
+
+    def release(self):
+        self.cap.release()
@@ -0,0 +1,231 @@
+# Decoded frame store for EGR 530
+# Decodes a video once into raw, memory-mapped frames so that repeated tuning runs don't have to decode it again
+# Example: python FrameStore.py videos/input2.mp4 --intermediates hsv edges
+#          cap = StoreCapture("videos/input2.frames")
+
+import argparse
+import json
+import os
+import time
+
+import cv2 as cv
+import numpy as np
+
+from HelperFunctions import DetectEdges
+
+# Intermediate frames that can be saved with a store, and how to make them from a frame
+# The recolored frame depends on the HSV ranges so it isn't stored, and the edges are stored for one set of Canny
+# thresholds (recorded in meta.json) and only used by detectors with the same thresholds
+intermediateTypes = {
+    'hsv': lambda frame, edgeThresholds: cv.cvtColor(frame, cv.COLOR_BGR2HSV),
+    'edges': lambda frame, edgeThresholds: DetectEdges(frame, thresholds = edgeThresholds),
+}
+
+# Decode a video into a store folder, optionally also saving intermediate frames
+# The store folder has one raw file per frame type (frames.raw, hsv.raw, ...), the timestamps, and meta.json
+def BuildFrameStore(videoPath, storePath, intermediates = (), maxFrames = None, edgeThresholds = (50, 150)):
+    for name in intermediates:
+        if name not in intermediateTypes:
+            raise ValueError("Unknown intermediate: " + name)
+
+    cap = cv.VideoCapture(videoPath)
+    if not cap.isOpened():
+        raise IOError("Could not open video: " + videoPath)
+
+    os.makedirs(storePath, exist_ok = True)
+    files = {name: open(os.path.join(storePath, name + '.raw'), 'wb') for name in ('frames',) + tuple(intermediates)}
+    shapes = {}
+    timestamps = []
+
+    try:
+        while maxFrames is None or len(timestamps) < maxFrames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if not shapes:
+                shapes['frames'] = frame.shape
+
+            # Frames are appended to the raw files as they are decoded, so the frame count doesn't need to be known
+            frame.tofile(files['frames'])
+            for name in intermediates:
+                img = intermediateTypes[name](frame, edgeThresholds)
+                shapes[name] = img.shape
+                img.tofile(files[name])
+            timestamps.append(cap.get(cv.CAP_PROP_POS_MSEC))
+        fps = cap.get(cv.CAP_PROP_FPS)
+    finally:
+        cap.release()
+        for f in files.values():
+            f.close()
+
+    if not timestamps:
+        raise IOError("No frames could be read from video: " + videoPath)
+
+    np.save(os.path.join(storePath, 'timestamps.npy'), np.array(timestamps))
+    meta = {
+        'source': os.path.abspath(videoPath),
+        'frameCount': len(timestamps),
+        'fps': fps,
+        'shapes': {name: list(shape) for name, shape in shapes.items()},
+    }
+    if 'edges' in intermediates:
+        meta['edgeThresholds'] = list(edgeThresholds)
+    with open(os.path.join(storePath, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent = 2)
+
+    return FrameStore(storePath)
+
+# Frames of a store, memory-mapped read-only so frames are only loaded from disk (or the page cache) when used
+class FrameStore:
+    def __init__(self, storePath):
+        with open(os.path.join(storePath, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = storePath
+        self.source = meta['source']
+        self.fps = meta['fps']
+        self.timestamps = np.load(os.path.join(storePath, 'timestamps.npy'))
+
+        # Canny thresholds of the saved edges (None for stores saved without them, whose edges are never used)
+        self.edgeThresholds = tuple(meta['edgeThresholds']) if 'edgeThresholds' in meta else None
+
+        # Every frame type as a single (frame count, height, width, ...) array
+        count = meta['frameCount']
+        self.arrays = {}
+        for name, shape in meta['shapes'].items():
+            self.arrays[name] = np.memmap(os.path.join(storePath, name + '.raw'), dtype = np.uint8, mode = 'r', shape = (count,) + tuple(shape))
+        self.frames = self.arrays['frames']
+
+    def __len__(self):
+        return len(self.frames)
+
+    # Names of the intermediate frames saved with the store
+    def Intermediates(self):
+        return [name for name in self.arrays if name != 'frames']
+
+    # Get the saved intermediate frames for a frame index, as a dictionary of name: frame
+    # The edges are left out unless they were saved with edgeThresholds (the Canny thresholds of the detector)
+    def IntermediatesAt(self, index, edgeThresholds = None):
+        names = self.Intermediates()
+        if edgeThresholds is None or self.edgeThresholds != tuple(edgeThresholds):
+            names = [name for name in names if name != 'edges']
+        return {name: self.arrays[name][index] for name in names}
+
+# Replays a frame store with the same read/isOpened/get/set/release interface as cv.VideoCapture
+# Frames returned by read() are read-only views of the store (no copy), and set(cv.CAP_PROP_POS_FRAMES, n) seeks to
+# any frame
+class StoreCapture:
+    def __init__(self, store, start = 0):
+        # Accept either an open store or the path of a store folder
+        if not isinstance(store, FrameStore):
+            store = FrameStore(store)
+        self.store = store
+
+        # Index of the next frame to read, and of the last frame returned by read()
+        self.position = start
+        self.current = None
+
+    def read(self):
+        if self.store is None or self.position >= len(self.store):
+            return False, None
+        self.current = self.position
+        self.position += 1
+        return True, self.store.frames[self.current]
+
+    # Move past the next frame without returning it
+    def grab(self):
+        if self.store is None or self.position >= len(self.store):
+            return False
+        self.current = self.position
+        self.position += 1
+        return True
+
+    def isOpened(self):
+        return self.store is not None
+
+    # Saved intermediate frames for the last frame returned by read(), as a dictionary of name: frame
+    # The edges are left out unless they were saved with edgeThresholds (the Canny thresholds of the detector)
+    def Intermediates(self, edgeThresholds = None):
+        if self.current is None:
+            return {}
+        return self.store.IntermediatesAt(self.current, edgeThresholds)
+
+    def get(self, propId):
+        if self.store is None:
+            return 0
+        if propId == cv.CAP_PROP_POS_FRAMES:
+            return self.position
+        if propId == cv.CAP_PROP_POS_MSEC:
+            return float(self.store.timestamps[self.current]) if self.current is not None else 0.0
+        if propId == cv.CAP_PROP_FRAME_COUNT:
+            return len(self.store)
+        if propId == cv.CAP_PROP_FPS:
+            return self.store.fps
+        if propId == cv.CAP_PROP_FRAME_WIDTH:
+            return self.store.frames.shape[2]
+        if propId == cv.CAP_PROP_FRAME_HEIGHT:
+            return self.store.frames.shape[1]
+        return 0
+
+    # Seek to a frame index or a timestamp
+    def set(self, propId, value):
+        if self.store is None:
+            return False
+        if propId == cv.CAP_PROP_POS_FRAMES:
+            self.position = int(min(max(value, 0), len(self.store)))
+            return True
+        if propId == cv.CAP_PROP_POS_MSEC:
+            self.position = int(np.searchsorted(self.store.timestamps, value))
+            return True
+        return False
+
+    def release(self):
+        self.store = None
+
+# Get the saved intermediate frames a detector can use for the last frame read from a capture, to pass to its Process as
+# known, or None if the capture isn't a frame store
+def KnownFrames(cap, detector):
+    if not isinstance(cap, StoreCapture):
+        return None
+    # Look through wrappers such as AdaptiveResolution to the detector itself
+    detector = getattr(detector, 'detector', detector)
+    return cap.Intermediates(detector.cannyThresholds)
+
+# Open a video file or a frame store folder for reading frames in order
+# Video files are decoded in a separate thread (FrameCapture.py), stores are read directly
+def OpenVideo(path):
+    if os.path.isdir(path):
+        return StoreCapture(path)
+    from FrameCapture import ThreadedCapture
+    return ThreadedCapture(path, 'file')
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Decode a video once into a memory-mapped frame store")
+    parser.add_argument('video', help = "video file to decode")
+    parser.add_argument('--output', default = None, help = "store folder (default: the video path with .frames in place of the extension)")
+    parser.add_argument('--intermediates', nargs = '*', choices = sorted(intermediateTypes), default = [], help = "intermediate frames to save with the store")
+    parser.add_argument('--max-frames', type = int, default = None, help = "only decode this many frames")
+    parser.add_argument('--canny-thresholds', type = int, nargs = 2, default = [50, 150], help = "Canny thresholds of the saved edges (only detectors with the same thresholds use them)")
+    args = parser.parse_args()
+
+    storePath = args.output or os.path.splitext(args.video)[0] + '.frames'
+
+    start = time.perf_counter()
+    store = BuildFrameStore(args.video, storePath, args.intermediates, args.max_frames, tuple(args.canny_thresholds))
+    decodeTime = time.perf_counter() - start
+
+    # Compare decoding with reading the store back
+    start = time.perf_counter()
+    cap = StoreCapture(store)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame.sum(dtype = np.uint64)
+    readTime = time.perf_counter() - start
+
+    size = sum(array.nbytes for array in store.arrays.values())
+    print("{}: {} frames -> {} ({:.1f} MB)".format(args.video, len(store), storePath, size / 1e6))
+    print("  decode and store {:.2f} s, read back {:.2f} s".format(decodeTime, readTime))
+
+if __name__ == '__main__':
+    Main()
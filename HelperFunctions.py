@@ -1,19 +1,31 @@
 import cv2 as cv
 import numpy as np
+import threading
+from collections import OrderedDict
+
+# Maximum number of region of interest masks to keep between frames
+maskCacheSize = 16
+
+# Region of interest masks that have already been drawn, least recently used first
+# The cache is shared by every detector, including detectors run from a thread pool (LaneService.py), so it is locked
+maskCache = OrderedDict()
+maskCacheLock = threading.Lock()
 
 # Frame Adjustments ####################################################################################################
 # Find edges in a frame using canny edge detection
-def DetectEdges(frame):
+# Pass dst, gray, and blur to reuse existing arrays for the result and intermediate frames
+# thresholds are the (minVal, maxVal) hysteresis thresholds of the Canny edge detector
+def DetectEdges(frame, dst = None, gray = None, blur = None, thresholds = (50, 150)):
     try:
         # Converts frame to grayscale because we only need the luminance channel for detecting edges - less computationally expensive
-        gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY)
+        gray = cv.cvtColor(frame, cv.COLOR_RGB2GRAY, dst = gray)
     except cv.error:
         # Frame is already grayscale
         gray = frame
     # Applies a 5x5 gaussian blur with deviation of 0 to frame - not mandatory since Canny will do this for us
-    blur = cv.GaussianBlur(gray, (5, 5), 0)
-    # Applies Canny edge detector with minVal of 50 and maxVal of 150
-    frame_edges = cv.Canny(blur, 50, 150)
+    blur = cv.GaussianBlur(gray, (5, 5), 0, dst = blur)
+    # Applies Canny edge detector with minVal and maxVal (50 and 150 by default)
+    frame_edges = cv.Canny(blur, thresholds[0], thresholds[1], edges = dst)
     # Return a frame showing all edges
     return frame_edges
 
@@ -26,11 +38,41 @@ def ResizeFrame(frame, scale_factor):
     return frame_resized
 
 # Masking ##############################################################################################################
-# Crop a frame to a tapered rectangular region
-def RectangularMask(frame, topPos, bottomPos, leftPos, rightPos, leftTaper = 0, rightTaper = 0):
+# Get a mask the same size as a frame with a polygon filled in
+# Masks are cached by frame shape and polygon coords, since the region of interest usually stays the same between frames
+def GetPolygonMask(frame, polygons):
+    # The polygon coords are already rounded to whole pixels, so they can be used directly as part of the key
+    key = (frame.shape, frame.dtype.str, polygons.astype(np.int32).tobytes())
+
+    with maskCacheLock:
+        mask = maskCache.get(key)
+        if mask is not None:
+            # Mark the mask as recently used
+            maskCache.move_to_end(key)
+            return mask
+
+    # Creates an image filled with zero intensities with the same dimensions as the frame
+    mask = np.zeros_like(frame)
+
+    # Allows the mask to be filled with values of 1 and the other areas to be filled with values of 0
+    cv.fillPoly(mask, polygons, 255)
+
+    # Cached masks are shared, so make sure they are not modified
+    mask.flags.writeable = False
+
+    # Add the mask to the cache, removing the least recently used mask if the cache is full
+    with maskCacheLock:
+        maskCache[key] = mask
+        if len(maskCache) > maskCacheSize:
+            maskCache.popitem(last = False)
+
+    return mask
+
+# Get the polygon of a tapered rectangular region of a frame, and the coords of its edges
+def RectangularPolygon(shape, topPos, bottomPos, leftPos, rightPos, leftTaper = 0, rightTaper = 0):
     # Get the dimensions of the frame
-    height = frame.shape[0]
-    width = frame.shape[1]
+    height = shape[0]
+    width = shape[1]
 
     # Creates a polygon for the mask defined by four (x, y) coordinates
     polygons = np.array([[
@@ -40,15 +82,6 @@ def RectangularMask(frame, topPos, bottomPos, leftPos, rightPos, leftTaper = 0,
         (round(width * leftPos), round(height * bottomPos))
     ]])
 
-    # Creates an image filled with zero intensities with the same dimensions as the frame
-    mask = np.zeros_like(frame)
-
-    # Allows the mask to be filled with values of 1 and the other areas to be filled with values of 0
-    cv.fillPoly(mask, polygons, 255)
-
-    # A bitwise and operation between the mask and frame keeps only the triangular area of the frame
-    frame_cropped = cv.bitwise_and(frame, mask)
-
     # Get the coords of the crop region edges
     edgeCoords = np.array([
         [polygons[0][0][0], polygons[0][0][1], polygons[0][1][0], polygons[0][1][1]],
@@ -57,11 +90,57 @@ def RectangularMask(frame, topPos, bottomPos, leftPos, rightPos, leftTaper = 0,
         [polygons[0][3][0], polygons[0][3][1], polygons[0][0][0], polygons[0][0][1]],
     ])
 
+    return polygons, edgeCoords
+
+# Crop a frame to a tapered rectangular region
+# Pass dst to write the result into an existing array instead of allocating a new one
+def RectangularMask(frame, topPos, bottomPos, leftPos, rightPos, leftTaper = 0, rightTaper = 0, dst = None):
+    polygons, edgeCoords = RectangularPolygon(frame.shape, topPos, bottomPos, leftPos, rightPos, leftTaper, rightTaper)
+
+    # Get a mask with the polygon filled, reusing the last one if the frame shape and polygon have not changed
+    mask = GetPolygonMask(frame, polygons)
+
+    # A bitwise and operation between the mask and frame keeps only the triangular area of the frame
+    frame_cropped = cv.bitwise_and(frame, mask, dst = dst)
+
     # Return frame with the mask applied
     return frame_cropped, edgeCoords
 
+# Crop a frame to a tapered rectangular region, only working inside the bounding box of the region
+# The band detector now fits all of its bands at once (FitBandLines), so this is only used by Benchmark.py, to compare
+# with RectangularMask
+def RectangularMaskLocal(frame, topPos, bottomPos, leftPos, rightPos, leftTaper = 0, rightTaper = 0):
+    # Get the dimensions of the frame
+    height = frame.shape[0]
+    width = frame.shape[1]
+
+    polygons, edgeCoords = RectangularPolygon(frame.shape, topPos, bottomPos, leftPos, rightPos, leftTaper, rightTaper)
+
+    # Get the bounding box of the polygon, limited to the frame
+    x0 = int(min(max(np.min(polygons[0, :, 0]), 0), width))
+    x1 = int(min(max(np.max(polygons[0, :, 0]) + 1, 0), width))
+    y0 = int(min(max(np.min(polygons[0, :, 1]), 0), height))
+    y1 = int(min(max(np.max(polygons[0, :, 1]) + 1, 0), height))
+
+    # Get a view of the frame inside the bounding box (no copy)
+    frame_band = frame[y0:y1, x0:x1]
+
+    # Creates an image filled with zero intensities with the same dimensions as the bounding box
+    mask = np.zeros_like(frame_band)
+
+    # Fill the polygon, shifted so that it lines up with the bounding box
+    if mask.size > 0:
+        cv.fillPoly(mask, polygons, 255, offset = (-x0, -y0))
+
+    # A bitwise and operation between the mask and the band keeps only the tapered area of the band
+    frame_cropped = cv.bitwise_and(frame_band, mask) if mask.size > 0 else mask
+
+    # Return the masked band, the crop region edges, and the position of the band in the frame
+    return frame_cropped, edgeCoords, (x0, y0)
+
 # Crop a frame to a triangular region
-def TriangularMask(frame, topPointPos, bottomPointPos):
+# Pass dst to write the result into an existing array instead of allocating a new one
+def TriangularMask(frame, topPointPos, bottomPointPos, dst = None):
     # Get the dimensions of the frame
     height = frame.shape[0]
     width = frame.shape[1]
@@ -75,14 +154,11 @@ def TriangularMask(frame, topPointPos, bottomPointPos):
         (0, round(height * bottomPointPos))
     ]])
 
-    # Creates an image filled with zero intensities with the same dimensions as the frame
-    mask = np.zeros_like(frame)
-
-    # Allows the mask to be filled with values of 1 and the other areas to be filled with values of 0
-    cv.fillPoly(mask, polygons, 255)
+    # Get a mask with the polygon filled, reusing the last one if the frame shape and polygon have not changed
+    mask = GetPolygonMask(frame, polygons)
 
     # A bitwise and operation between the mask and frame keeps only the triangular area of the frame
-    frame_cropped = cv.bitwise_and(frame, mask)
+    frame_cropped = cv.bitwise_and(frame, mask, dst = dst)
 
     # Get the coords of the crop region edges
     edgeCoords = np.array([
@@ -98,11 +174,12 @@ def TriangularMask(frame, topPointPos, bottomPointPos):
 
 # Display ##############################################################################################################
 # Calculate the end coordinates of a line given its slope and y intercept
-def CalculateEndCoordinates(frame, parameters, topPointPos, bottomPointPos):
+def CalculateEndCoordinates(frame, parameters, topPointPos, bottomPointPos, height = None):
     slope, intercept = parameters
 
     # Get the dimensions of the frame
-    height = frame.shape[0]
+    if height is None:
+        height = frame.shape[0]
     # width = frame.shape[1]
 
     # Sets initial and final y-coordinates
@@ -118,84 +195,174 @@ def CalculateEndCoordinates(frame, parameters, topPointPos, bottomPointPos):
     return coords
 
 # Draw lines on a frame
-def DrawLines(frame, lineCoords, color = (255, 0, 0)):
+# Pass a list as regions to add the rectangles drawn in to it (see AddOverlayRegions)
+def DrawLines(frame, lineCoords, color = (255, 0, 0), regions = None):
     # Check if any lines are detected
     if lineCoords is not None:
         for x1, y1, x2, y2 in lineCoords:
             # Draw lines between two coordinates with color and 5 thickness
             cv.line(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 5)
+            if regions is not None:
+                AddLineRegions(regions, (int(x1), int(y1)), (int(x2), int(y2)), 5)
     return frame
 
 # Draw text on a frame
-def DrawText(frame, text, pos = 0.95, color = (255, 0, 0)):
+def DrawText(frame, text, pos = 0.95, color = (255, 0, 0), regions = None):
     # Get the dimensions of the frame
     height = frame.shape[0]
     # Add text
     font = cv.FONT_HERSHEY_SIMPLEX
     cv.putText(frame, str(text), (5,round(height*pos)), font, 1, color, 2, cv.LINE_AA)
+    if regions is not None:
+        (textWidth, textHeight), baseline = cv.getTextSize(str(text), font, 1, 2)
+        regions.append((3, round(height*pos) - textHeight - 3, textWidth + 6, textHeight + baseline + 6))
     return frame
 
 # Draw a small pointer at the bottom of a frame
-def DrawPointer(frame, xPos, color = (255, 0, 0), topPoint = 0.95):
+def DrawPointer(frame, xPos, color = (255, 0, 0), topPoint = 0.95, regions = None):
     # Get the dimensions of the frame
     height = frame.shape[0]
     width = frame.shape[1]
-    cv.line(frame, (int(width * xPos), height), (int(width * xPos), int(height * topPoint)), color, 5)
-    cv.line(frame, (int(width * xPos), int(topPoint * height)), (int(width * (xPos-0.008)), int(height * (topPoint+0.016))), color, 5)
-    cv.line(frame, (int(width * xPos), int(topPoint * height)), (int(width * (xPos+0.008)), int(height * (topPoint+0.016))), color, 5)
+    lines = [
+        ((int(width * xPos), height), (int(width * xPos), int(height * topPoint))),
+        ((int(width * xPos), int(topPoint * height)), (int(width * (xPos-0.008)), int(height * (topPoint+0.016)))),
+        ((int(width * xPos), int(topPoint * height)), (int(width * (xPos+0.008)), int(height * (topPoint+0.016)))),
+    ]
+    for p1, p2 in lines:
+        cv.line(frame, p1, p2, color, 5)
+    # The pointer is small, so one rectangle covers all of it
+    if regions is not None:
+        xs = [x for line in lines for x, y in line]
+        ys = [y for line in lines for x, y in line]
+        regions.append((min(xs) - 4, min(ys) - 4, max(xs) - min(xs) + 9, max(ys) - min(ys) + 9))
     return frame
 
-def InitOverlay(frame):
+# Pass the previous overlay to clear and reuse it instead of allocating a new one
+def InitOverlay(frame, overlay = None):
+    if overlay is not None and overlay.shape == frame.shape and overlay.dtype == frame.dtype:
+        overlay.fill(0)
+        return overlay
     # Create an image filled with zero intensities with the same dimensions as the frame
     overlay = np.zeros_like(frame)
     return overlay
 
-def AddOverlay(frame, overlay):
-    frame_overlay = np.zeros_like(frame)
-    cv.addWeighted(overlay, 0.9, frame, 1, 0, frame_overlay)
+# Pass dst to write the result into an existing array instead of allocating a new one
+def AddOverlay(frame, overlay, dst = None):
+    frame_overlay = cv.addWeighted(overlay, 0.9, frame, 1, 0, dst = dst)
     return frame_overlay
 
+# Overlay regions ######################################################################################################
+# An overlay is mostly empty, so instead of clearing and blending the whole frame, the drawing functions can record the
+# rectangles (x, y, width, height) they draw in, and only those rectangles are cleared and blended
+
+# Add the rectangles covering a line of a given thickness
+# Diagonal lines are split into pieces, so they don't bring in the whole empty rectangle around them
+def AddLineRegions(regions, p1, p2, thickness, step = 64):
+    (x1, y1), (x2, y2) = p1, p2
+    pieces = max(1, -(-min(abs(x2 - x1), abs(y2 - y1)) // step))
+    margin = thickness // 2 + 2
+    for i in range(pieces):
+        xa = x1 + (x2 - x1) * i // pieces
+        ya = y1 + (y2 - y1) * i // pieces
+        xb = x1 + (x2 - x1) * (i + 1) // pieces
+        yb = y1 + (y2 - y1) * (i + 1) // pieces
+        regions.append((min(xa, xb) - margin, min(ya, yb) - margin, abs(xb - xa) + 2 * margin + 1, abs(yb - ya) + 2 * margin + 1))
+    return regions
+
+# Clip rectangles to a frame, leaving out any that are outside it
+def ClipRegions(regions, shape):
+    height, width = shape[:2]
+    clipped = []
+    for x, y, w, h in regions:
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, width), min(y + h, height)
+        if x2 > x1 and y2 > y1:
+            clipped.append((x1, y1, x2 - x1, y2 - y1))
+    return clipped
+
+# Check if blending only the regions is cheaper than blending the whole frame
+# Each region costs about as much as blending callArea pixels on top of its own area (the Python call overhead), and
+# copying the frame first costs about a third of blending all of it, so large or many regions are slower on small frames
+def RegionsCheaper(shape, regions, callArea = 10000):
+    frameArea = shape[0] * shape[1]
+    regionArea = sum(w * h for x, y, w, h in regions)
+    return regionArea + len(regions) * callArea < 0.7 * frameArea
+
+# Clear an overlay only inside the regions drawn in, so it can be reused for the next frame
+def ClearOverlayRegions(overlay, regions):
+    regions = ClipRegions(regions, overlay.shape)
+    if not RegionsCheaper(overlay.shape, regions):
+        overlay.fill(0)
+        return overlay
+    for x, y, w, h in regions:
+        overlay[y:y+h, x:x+w] = 0
+    return overlay
+
+# Same result as AddOverlay when nothing was drawn outside the regions: the frame is copied, and the overlay is only
+# blended in inside the regions (or over the whole frame if that is cheaper)
+# Pass dst to write the result into an existing array instead of allocating a new one
+def AddOverlayRegions(frame, overlay, regions, dst = None):
+    if dst is None or dst.shape != frame.shape or dst.dtype != frame.dtype:
+        dst = np.empty_like(frame)
+    regions = ClipRegions(regions, frame.shape)
+    if not RegionsCheaper(frame.shape, regions):
+        return AddOverlay(frame, overlay, dst)
+    np.copyto(dst, frame)
+    for x, y, w, h in regions:
+        cv.addWeighted(overlay[y:y+h, x:x+w], 0.9, frame[y:y+h, x:x+w], 1, 0, dst = dst[y:y+h, x:x+w])
+    return dst
+
 # Line detection algorithms ############################################################################################
 # Find the left and right lane lines by averaging the detected edges
-def FindLaneLinesHough(frame_edges, topPointPos, bottomPointPos):
+# Pass scale if the frame has been resized, so that the pixel based limits are resized to match
+# If frame_edges is part of a larger frame, pass its offset and the full frame height to get frame coords
+# threshold (votes), minLineLength, and maxLineGap are the Hough limits at full resolution
+def FindLaneLinesHough(frame_edges, topPointPos, bottomPointPos, scale = 1.0, offset = (0, 0), height = None,
+                       threshold = 100, minLineLength = 100, maxLineGap = 50):
     # Get the endpoints of every detected edge
-    hough = cv.HoughLinesP(frame_edges, 2, np.pi / 180, 100, np.array([]), minLineLength = 100, maxLineGap = 50)
-    # Empty arrays to store the coordinates of the left and right lines
-    left = []
-    right = []
-    # Loops through every detected line
+    hough = cv.HoughLinesP(frame_edges, max(1, 2 * scale), np.pi / 180, max(1, round(threshold * scale)), np.array([]), minLineLength = minLineLength * scale, maxLineGap = maxLineGap * scale)
+    # Check if any lines are detected
     if hough is not None:
-        for line in hough:
-            # Reshapes line from 2D array to 1D array
-            x1, y1, x2, y2 = line.reshape(4)
-
-            # Fits a linear polynomial to the x and y coordinates and returns a vector of coefficients which describe the slope and y-intercept
-            parameters = np.polyfit((x1, x2), (y1, y2), 1)
-            slope = parameters[0]
-            yIntercept = parameters[1]
-
-            # If slope is in the expected range (10deg to 80deg)
-            if (abs(slope) > 0.36) and (abs(slope) < 5.67):
-                # If slope is negative, the line is to the left of the lane, and otherwise, the line is to the right of the lane
-                if slope < 0:
-                    left.append((slope, yIntercept))
-                else:
-                    right.append((slope, yIntercept))
-
-        if (len(left) == 0) and (len(right) == 0):
+        # Reshapes lines from (N, 1, 4) to four arrays of N endpoint coords
+        x1, y1, x2, y2 = hough.reshape(-1, 4).astype(np.float64).T
+
+        # Shift the lines back into frame coords
+        x1 += offset[0]
+        x2 += offset[0]
+        y1 += offset[1]
+        y2 += offset[1]
+        dx = x2 - x1
+        dy = y2 - y1
+
+        # Vertical lines have no slope and are outside the expected range anyway, so leave them out explicitly
+        notVertical = dx != 0
+
+        # Calculate the slope and y-intercept of every line at once
+        slope = np.zeros_like(dx)
+        np.divide(dy, dx, out = slope, where = notVertical)
+        yIntercept = y1 - slope * x1
+
+        # If slope is in the expected range (10deg to 80deg)
+        inRange = notVertical & (np.abs(slope) > 0.36) & (np.abs(slope) < 5.67)
+
+        # If slope is negative, the line is to the left of the lane, and otherwise, the line is to the right of the lane
+        left = inRange & (slope < 0)
+        right = inRange & (slope >= 0)
+
+        if not (left.any() or right.any()):
             raise ValueError("No lines in slope range")
         else:
-            if len(left) > 0:
+            if left.any():
                 # Average out all the values into a single slope and y-intercept value and calculate the x1, y1, x2, y2 coordinates
-                leftAvg = np.average(left, axis = 0)
-                leftLine = CalculateEndCoordinates(frame_edges, leftAvg, topPointPos, bottomPointPos)
+                leftAvg = (np.mean(slope[left]), np.mean(yIntercept[left]))
+                leftLine = CalculateEndCoordinates(frame_edges, leftAvg, topPointPos, bottomPointPos, height)
             else:
                 leftLine = np.array([0, 0, 0, 0])
 
-            if len(right) > 0:
+            if right.any():
                 # Average out all the values into a single slope and y-intercept value and calculate the x1, y1, x2, y2 coordinates
-                rightAvg = np.average(right, axis = 0)
-                rightLine = CalculateEndCoordinates(frame_edges, rightAvg, topPointPos, bottomPointPos)
+                rightAvg = (np.mean(slope[right]), np.mean(yIntercept[right]))
+                rightLine = CalculateEndCoordinates(frame_edges, rightAvg, topPointPos, bottomPointPos, height)
             else:
                 rightLine = np.array([0, 0, 0, 0])
 
@@ -205,19 +372,25 @@ def FindLaneLinesHough(frame_edges, topPointPos, bottomPointPos):
         raise ValueError("No lines in frame")
 
 # Find a single lane line by fitting a line to the detected contours
-def FindLaneLineFit(frame_edges, laneCoords, topPointPos, bottomPointPos):
+# If frame_edges is a band from RectangularMaskLocal, pass its offset and the full frame height to get frame coords
+def FindLaneLineFit(frame_edges, laneCoords, topPointPos, bottomPointPos, offset = (0, 0), height = None):
     # Get the dimensions of the frame
-    height = frame_edges.shape[0]
+    if height is None:
+        height = frame_edges.shape[0]
     # width = frame_edges.shape[1]
 
     # Update base values for new lane coords
     laneCoordsNew = np.copy(laneCoords)
 
-    # Get line contours
-    lineContours, _ = cv.findContours(frame_edges, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+    # An empty band has no contours
+    if frame_edges.size == 0:
+        raise IndexError("Empty band")
+
+    # Get line contours, shifted back into frame coords
+    lineContours, _ = cv.findContours(frame_edges, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE, offset = offset)
 
     # Fit a line to each set of contours
-    vx, vy, x, y = cv.fitLine(lineContours[0], cv.DIST_L2, 0, 0.01, 0.01)
+    vx, vy, x, y = cv.fitLine(lineContours[0], cv.DIST_L2, 0, 0.01, 0.01).flatten()
 
     # Find line y coords
     y1 = topPointPos * height
@@ -229,4 +402,91 @@ def FindLaneLineFit(frame_edges, laneCoords, topPointPos, bottomPointPos):
         xL2 = int(x + ((y2 - y) * (vx / vy)))
         laneCoordsNew = np.array([xL1, y1, xL2, y2])
 
-    return laneCoordsNew
\ No newline at end of file
+    return laneCoordsNew
+
+# Fit a line to the edge pixels in every band and side at once
+# Bands are stacked rows of the frame, each with a left and right window, given as fractions of the frame:
+#   bandTops, bandBottoms - (bands,) top and bottom of each band (measured from the top, bands must not overlap)
+#   windows - (bands, 2, 4) [left, right, leftTaper, rightTaper] of the left and right window of each band, where the
+#             tapers move the top corners inwards like RectangularMask
+# Every edge pixel in a window is used, fitting x = a * y + b by least squares. Lane lines are close to vertical, and a band
+# is short and wide, so a window often holds several parallel edges (both sides of a painted line, the road edge) side by
+# side. Measuring the error along x keeps the slope of those edges, where a total least squares fit (cv.fitLine) tips
+# over to a horizontal line through all of them
+# Returns:
+#   lines - (bands, 2, 4) [x1, y1, x2, y2] of each fitted line between the top (y1) and bottom (y2) of its band
+#   found - (bands, 2) True where a line was fitted with a slope in the expected range (10deg to 80deg)
+#   empty - (bands, 2) True where the window had no edge pixels
+def FitBandLines(frame_edges, bandTops, bandBottoms, windows):
+    height = frame_edges.shape[0]
+    width = frame_edges.shape[1]
+    bandTops = np.asarray(bandTops, dtype = np.float64)
+    bandBottoms = np.asarray(bandBottoms, dtype = np.float64)
+    windows = np.asarray(windows, dtype = np.float64)
+    bands = len(bandTops)
+
+    # Band rows in pixels
+    topRows = np.round(bandTops * height).astype(int)
+    bottomRows = np.round(bandBottoms * height).astype(int)
+
+    # Get the coords of every edge pixel in the rows covered by the bands in one pass (cv.findNonZero is faster than
+    # np.nonzero for this)
+    y0 = min(max(int(topRows.min()), 0), height)
+    y1 = min(max(int(bottomRows.max()) + 1, 0), height)
+    points = cv.findNonZero(frame_edges[y0:y1]) if y1 > y0 else None
+    points = np.zeros((0, 2), dtype = np.int32) if points is None else points.reshape(-1, 2)
+    xs = points[:, 0]
+    ys = points[:, 1] + y0
+
+    # Assign each pixel to the band whose rows it is in
+    order = np.argsort(topRows)
+    index = np.searchsorted(topRows[order], ys, side = 'right') - 1
+    band = order[np.maximum(index, 0)]
+    inBand = (index >= 0) & (ys <= bottomRows[band])
+    ys = ys[inBand].astype(np.float64)
+    xs = xs[inBand].astype(np.float64)
+    band = band[inBand]
+
+    # Position of each pixel within its band, 0 at the bottom and 1 at the top, for the tapered window edges
+    bandHeight = np.maximum(bottomRows[band] - topRows[band], 1)
+    t = (bottomRows[band] - ys) / bandHeight
+
+    # Assign each pixel to the left and/or right window of its band (windows can overlap)
+    groups = []
+    groupXs = []
+    groupYs = []
+    for side in (0, 1):
+        left, right, leftTaper, rightTaper = windows[band, side].T
+        inside = (xs >= (left + t * leftTaper) * width) & (xs <= (right - t * rightTaper) * width)
+        groups.append(band[inside] * 2 + side)
+        groupXs.append(xs[inside])
+        groupYs.append(ys[inside])
+    groups = np.concatenate(groups)
+    xs = np.concatenate(groupXs)
+    ys = np.concatenate(groupYs)
+
+    # Means and covariances of the pixels in every window
+    count = np.bincount(groups, minlength = bands * 2).astype(np.float64)
+    empty = count == 0
+    n = np.maximum(count, 1)
+    meanX = np.bincount(groups, xs, bands * 2) / n
+    meanY = np.bincount(groups, ys, bands * 2) / n
+    dx = xs - meanX[groups]
+    dy = ys - meanY[groups]
+    syy = np.bincount(groups, dy * dy, bands * 2)
+    sxy = np.bincount(groups, dx * dy, bands * 2)
+
+    # Change in x per row of each line (windows with every pixel in one row have no fit)
+    fitted = (count >= 2) & (syy > 0)
+    a = np.zeros(bands * 2)
+    np.divide(sxy, syy, out = a, where = fitted)
+
+    # If slope is in the expected range (10deg to 80deg, so dx/dy between 1/5.67 and 1/0.36), find line x coords
+    found = fitted & (np.abs(a) > 1 / 5.67) & (np.abs(a) < 1 / 0.36)
+    yTop = np.repeat(bandTops * height, 2)
+    yBottom = np.repeat(bandBottoms * height, 2)
+    xTop = np.where(found, meanX + (yTop - meanY) * a, 0)
+    xBottom = np.where(found, meanX + (yBottom - meanY) * a, 0)
+
+    lines = np.stack([np.trunc(xTop), yTop, np.trunc(xBottom), yBottom], axis = 1)
+    return lines.reshape(bands, 2, 4), found.reshape(bands, 2), empty.reshape(bands, 2)
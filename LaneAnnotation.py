@@ -2,10 +2,12 @@
 
 # Import helper functions file
 from HelperFunctions import *
-import warnings
-
-# Suppress output from polyfit warning
-warnings.simplefilter('ignore', np.RankWarning)
+from LaneDetectors import HoughLaneDetector
+from FrameCapture import ThreadedCapture
+from FrameStore import StoreCapture, KnownFrames
+from StageTimer import StageTimer
+from ResultBus import ResultPublisher
+from OverlaySink import OverlaySink
 
 # Set the top and bottom points of the region of interest as a fraction of the frame (measured from the top)
 topPointMultiplier = 0.25
@@ -14,125 +16,54 @@ bottomPointMultiplier = 0.9
 # Set the rate at which lane positions will update
 lane_update_rate = 0.1
 
-# Variables to store latest coords of detected lane lines
-steeringValueG = 0
-laneCoordsG = np.array([[0, 0, 0, 0], [0, 0, 0, 0]])
-steeringValueGC = 0
-laneCoordsGC = np.array([[0, 0, 0, 0], [0, 0, 0, 0]])
-steeringValueCombined = 0
-laneCoordsCombined = np.array([[0, 0, 0, 0], [0, 0, 0, 0]])
-
-# The video feed is read in as a VideoCapture object
-cap = cv.VideoCapture("videos/input2.mp4")
-# cap = cv.VideoCapture(0)
-
-while cap.isOpened():
-    # Get current image
-    ret, img = cap.read()
-
-    # Initialize overlay
-    overlay = InitOverlay(img)
-
-    # Convert to HSV and isolate yellow and white
-    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
-    img_yellow = cv.inRange(img_hsv, (20, 39, 64), (35, 255, 255))
-    img_white = cv.inRange(img_hsv, (0, 0, 229), (180, 38, 255))
-    img_recolor = img_yellow + img_white
-
-    # Apply edge detection
-    img_edges = DetectEdges(img)
-    img_recolor_edges = DetectEdges(img_recolor)
-
-    # Apply crop
-    (img_edges_crop, cropBoundaryCoords) = TriangularMask(img_edges, topPointMultiplier, bottomPointMultiplier)
-    (img_recolor_edges_crop, _) = TriangularMask(img_recolor_edges, topPointMultiplier, bottomPointMultiplier)
+# Set to True to show the time taken by each stage and save a Chrome trace (trace.json) on exit
+showTimings = False
+timer = StageTimer(showTimings)
 
-    # Draw crop boundary on overlay
-    DrawLines(overlay, cropBoundaryCoords, (0, 0, 255))
-    DrawPointer(overlay, 0.5, (0, 0, 255))
+# Set to True to publish each result to the "lanes" shared-memory result bus for the steering controller (ResultBus.py)
+publishResults = False
+publisher = ResultPublisher("lanes") if publishResults else None
 
-    # Show recolored image
-    # cv.imshow("Edges", ResizeFrame(img_edges_crop, 0.8))
+# The detector stores the latest coords of detected lane lines between frames
+detector = HoughLaneDetector(topPointMultiplier, bottomPointMultiplier, lane_update_rate, timer = timer)
 
-    # Geometry only
-    try:
-        # Find lane lines
-        leftLine, rightLine = FindLaneLinesHough(img_edges_crop, topPointMultiplier, 1)
+# The overlay is drawn in a separate thread, which drops frames if it falls behind detection, and shown by sink.Show()
+sink = OverlaySink(detector, displayScale = 0.8, timer = timer, showStats = showTimings)
 
-        # Update lane coords
-        if np.count_nonzero(leftLine):
-            laneCoordsG[0] = leftLine
-        if np.count_nonzero(rightLine):
-            laneCoordsG[1] = rightLine
+# The video feed is read in a separate thread, which has the same interface as a VideoCapture object
+cap = ThreadedCapture("videos/input2.mp4")
+# cap = ThreadedCapture(0)
+# A frame store made with FrameStore.py can be replayed without decoding the video again
+# cap = StoreCapture("videos/input2.frames")
 
-        # Calculate steering value based on centers of lines
-        leftLineCenter = (laneCoordsG[0][0] + laneCoordsG[0][2]) / (2 * img_edges_crop.shape[1])
-        rightLineCenter = (laneCoordsG[1][0] + laneCoordsG[1][2]) / (2 * img_edges_crop.shape[1])
-        steeringValueG = (leftLineCenter + rightLineCenter) / 2
-
-        # Draw steering value
-        DrawText(overlay, " G: " + str(round(steeringValueG, 3)), 0.85, (0, 255, 0))
-        gFound = True
-    except ValueError:
-        # If lane lines are not found
-        DrawText(overlay, " G: error", 0.85, (0, 255, 0))
-        gFound = False
-
-    # Geometry + Color
-    try:
-        # Find lane lines
-        leftLine, rightLine = FindLaneLinesHough(img_recolor_edges_crop, topPointMultiplier, 1)
-
-        # Update lane coords
-        if np.count_nonzero(leftLine):
-            laneCoordsGC[0] = leftLine
-        if np.count_nonzero(rightLine):
-            laneCoordsGC[1] = rightLine
-
-        # Calculate steering value based on centers of lines
-        leftLineCenter = (laneCoordsGC[0][0] + laneCoordsGC[0][2]) / (2 * img_edges_crop.shape[1])
-        rightLineCenter = (laneCoordsGC[1][0] + laneCoordsGC[1][2]) / (2 * img_edges_crop.shape[1])
-        steeringValueGC = (leftLineCenter + rightLineCenter) / 2
-
-        # Draw steering value
-        DrawText(overlay, "GC: " + str(round(steeringValueGC, 3)), 0.9, (0, 255, 255))
-        gcFound = True
-    except ValueError:
-        # If lane lines are not found
-        DrawText(overlay, "GC: error", 0.9, (0, 255, 255))
-        gcFound = False
+while cap.isOpened():
+    # Get current image
+    ret, img = cap.read()
 
-    # Combine G and GC results
-    if gFound and gcFound:
-        laneCoordsCombined = lane_update_rate * (0.3 * laneCoordsG + 0.7 * laneCoordsGC) + (1 - lane_update_rate) * laneCoordsCombined
-        steeringValueCombined = lane_update_rate * (0.3 * steeringValueG + 0.7 * steeringValueGC) + (1 - lane_update_rate) * steeringValueCombined
-    elif gFound:
-        laneCoordsCombined = lane_update_rate * (0.8 * laneCoordsG + 0.2 * laneCoordsGC) + (1 - lane_update_rate) * laneCoordsCombined
-        steeringValueCombined = lane_update_rate * (0.8 * steeringValueG + 0.2 * steeringValueGC) + (1 - lane_update_rate) * steeringValueCombined
-    elif gcFound:
-        laneCoordsCombined = lane_update_rate * (0.0 * laneCoordsG + 1.0 * laneCoordsGC) + (1 - lane_update_rate) * laneCoordsCombined
-        steeringValueCombined = lane_update_rate * (0.0 * steeringValueG + 1.0 * steeringValueGC) + (1 - lane_update_rate) * steeringValueCombined
+    # Stop at the end of the video
+    if not ret:
+        break
 
-    # Draw final steering value
-    DrawText(overlay, " F: " + str(round(steeringValueCombined, 3)), 0.95, (255, 0, 0))
+    # Find lane lines, using the hsv and edges frames saved in a frame store if there are any
+    result = detector.Process(img, known = KnownFrames(cap, detector))
 
-    # Draw detected lane lines
-    DrawLines(overlay, laneCoordsG, (0, 255, 0))
-    DrawPointer(overlay, steeringValueG, (0, 255, 0))
-    DrawLines(overlay, laneCoordsGC, (0, 255, 255))
-    DrawPointer(overlay, steeringValueGC, (0, 255, 255))
-    DrawLines(overlay, laneCoordsCombined, (255, 0, 0))
-    DrawPointer(overlay, steeringValueCombined, (255, 0, 0))
+    # Publish the result as soon as it is ready
+    if publisher is not None:
+        publisher.Publish(cap.get(cv.CAP_PROP_POS_FRAMES) - 1, cap.get(cv.CAP_PROP_POS_MSEC), result, getattr(cap, 'arrivalTime', None))
 
-    # Open a new window and display the output image with overlay
-    frame_overlay = AddOverlay(img, overlay)
-    cv.imshow("Lane Detection", ResizeFrame(frame_overlay, 0.8))
+    # Draw the overlay and display the output image in the sink thread
+    sink.Submit(img, result)
 
-    # Read frames by intervals of 10 milliseconds
-    # Break out of the while loop when the user presses the 'q' key
-    if cv.waitKey(10) & 0xFF == ord('q'):
+    # Show the latest rendered frame, and break out of the while loop when the user presses the 'q' key
+    if not sink.Show():
         break
         
 # Free up resources and close all windows
 cap.release()
-cv.destroyAllWindows()
\ No newline at end of file
+sink.Close()
+if publisher is not None:
+    publisher.Close()
+
+# Save stage timings
+if showTimings:
+    timer.ExportChromeTrace("trace.json")
@@ -2,6 +2,12 @@
 
 # Import helper functions file
 from HelperFunctions import *
+from LaneDetectors import BandLaneDetector
+from FrameCapture import ThreadedCapture
+from FrameStore import StoreCapture, KnownFrames
+from StageTimer import StageTimer
+from ResultBus import ResultPublisher
+from OverlaySink import OverlaySink
 
 # Set the number of measurement bands
 measurementBands = 18
@@ -27,113 +33,55 @@ taperInner = -0.005
 # Set the rate at which lane positions will update
 lane_update_rate = 0.8
 
-# Variables to store latest coords of detected lane lines
-laneCoords = np.ones((measurementBands, 2, 4)) * 640
+# Set to True to show the time taken by each stage and save a Chrome trace (trace.json) on exit
+showTimings = False
+timer = StageTimer(showTimings)
 
-# The video feed is read in as a VideoCapture object
-cap = cv.VideoCapture("videos/test4s2.MP4")
-# cap = cv.VideoCapture(0)
+# Set to True to publish each result to the "lanes" shared-memory result bus for the steering controller (ResultBus.py)
+publishResults = False
+publisher = ResultPublisher("lanes") if publishResults else None
+
+# The detector stores the latest coords of detected lane lines between frames
+detector = BandLaneDetector(measurementBands, testBandMin, testBandMax, bottomPointMultiplier, bandHeight, bandWidth,
+                            scaleFalloff, taperOuter, taperInner, lane_update_rate, timer = timer)
+
+# The overlay is drawn in a separate thread, which drops frames if it falls behind detection, and shown by sink.Show()
+sink = OverlaySink(detector, displayScale = 1.0, timer = timer, showStats = showTimings)
+
+# The video feed is read in a separate thread, which has the same interface as a VideoCapture object
+cap = ThreadedCapture("videos/test4s2.MP4")
+# cap = ThreadedCapture(0)
+# A frame store made with FrameStore.py can be replayed without decoding the video again
+# cap = StoreCapture("videos/test4s2.frames")
 
 while cap.isOpened():
     # Get current image
     ret, img = cap.read()
 
-    # Show input image
-    # cv.imshow("Input", ResizeFrame(img, 0.8))
-
-    # Get the dimensions of the frame
-    height = img.shape[0]
-    width = img.shape[1]
-
-    # Initialize overlay
-    overlay = InitOverlay(img)
-
-    # Convert to HSV and isolate yellow and white
-    img_hsv = cv.cvtColor(img, cv.COLOR_BGR2HSV)
-    img_yellow = cv.inRange(img_hsv, (16, 39, 64), (35, 255, 255))
-    img_white = cv.inRange(img_hsv, (0, 0, 215), (180, 20, 255))
-    img_recolor = img_yellow + img_white
-
-    # Show recolored image
-    # cv.imshow("Recolor", ResizeFrame(img_recolor, 0.8))
-
-    # Apply edge detection
-    # img_edges = DetectEdges(img)
-    img_edges = DetectEdges(img_recolor)
-
-    # Show edges
-    # cv.imshow("Edges", ResizeFrame(img_edges, 0.8))
-
-    # Initial mask location values
-    currentBottom = bottomPointMultiplier
-    currentTop = bottomPointMultiplier - bandHeight
-    currentLL = 0.0
-    currentLR = 0.48
-    currentRL = 0.52
-    currentRR = 1.0
-
-    # Find lane lines in each measurement band
-    for b in range(measurementBands):
-        # Apply crop
-        img_edges_cropL, cropBoundaryCoords1 = RectangularMask(img_edges, currentTop, currentBottom, currentLL, currentLR, taperOuter * (scaleFalloff**b), taperInner * (scaleFalloff**b))
-        img_edges_cropR, cropBoundaryCoords2 = RectangularMask(img_edges, currentTop, currentBottom, currentRL, currentRR, taperInner * (scaleFalloff**b), taperOuter * (scaleFalloff**b))
-        img_edges_crop = img_edges_cropL + img_edges_cropR
-
-        # Draw crop boundary on overlay
-        # DrawLines(overlay, cropBoundaryCoords1, (0, 0, 255))
-        # DrawLines(overlay, cropBoundaryCoords2, (0, 0, 255))
-
-        # Find left lane line
-        try:
-            laneCoordsL = FindLaneLineFit(img_edges_cropL, laneCoords[b][0], currentTop, currentBottom)
-            laneCoords[b][0] = lane_update_rate*laneCoordsL + (1-lane_update_rate)*laneCoords[b][0]
-        except IndexError:
-            # print('No contours L')
-            pass
-
-        # Find right lane line
-        try:
-            laneCoordsR = FindLaneLineFit(img_edges_cropR, laneCoords[b][1], currentTop, currentBottom)
-            laneCoords[b][1] = lane_update_rate*laneCoordsR + (1-lane_update_rate)*laneCoords[b][1]
-        except IndexError:
-            # print('No contours R')
-            pass
-
-        # Draw detected lane lines
-        DrawLines(overlay, laneCoords[b], (0, 255, 0))
-
-        # if b == 0:
-            # cv.imshow("Cropped Edges", ResizeFrame(img_edges_crop, 0.8))
-            # img_lines = AddOverlay(img, overlay)
-            # cv.imshow("Fit Lines", ResizeFrame(img_lines, 0.8))
-
-        currentBottom = currentTop
-        currentTop = currentTop - bandHeight * (scaleFalloff ** b)
-        currentLL = float(laneCoords[b][0][0]/width) - (bandWidth * (scaleFalloff ** b))
-        currentLR = float(laneCoords[b][0][0]/width) + (bandWidth * (scaleFalloff ** b))
-        currentRL = float(laneCoords[b][1][0]/width) - (bandWidth * (scaleFalloff ** b))
-        currentRR = float(laneCoords[b][1][0]/width) + (bandWidth * (scaleFalloff ** b))
-
-    # Calculate steering value based on centers of lines
-    # laneCoords[bands][L/R][x1/y1/x2/y2]
-    leftLineCenter = (np.average(laneCoords[testBandMin:testBandMax+1, 0, 0]) + np.average(laneCoords[testBandMin:testBandMax+1, 0, 2])) / (2 * width)
-    rightLineCenter = (np.average(laneCoords[testBandMin:testBandMax+1, 1, 0]) + np.average(laneCoords[testBandMin:testBandMax+1, 1, 2])) / (2 * width)
-    steeringValue = (leftLineCenter + rightLineCenter) / 2
-
-    # Draw steering value
-    DrawText(overlay, "Steering: " + str(round(steeringValue, 3)), 0.98, (0, 255, 0))
-    DrawPointer(overlay, steeringValue, (0, 255, 0), 0.9)
-    DrawPointer(overlay, 0.5, (0, 0, 255))
-
-    # Open a new window and display the output image with overlay
-    frame_overlay = AddOverlay(img, overlay)
-    cv.imshow("Lane Detection", ResizeFrame(frame_overlay, 1.0))
-
-    # Read frames by intervals of 10 milliseconds
-    # Break out of the while loop when the user presses the 'q' key
-    if cv.waitKey(10) & 0xFF == ord('q'):
+    # Stop at the end of the video
+    if not ret:
+        break
+
+    # Find lane lines in each measurement band, using the hsv frames saved in a frame store if there are any
+    result = detector.Process(img, known = KnownFrames(cap, detector))
+
+    # Publish the result as soon as it is ready
+    if publisher is not None:
+        publisher.Publish(cap.get(cv.CAP_PROP_POS_FRAMES) - 1, cap.get(cv.CAP_PROP_POS_MSEC), result, getattr(cap, 'arrivalTime', None))
+
+    # Draw the detected lane lines and display the output image in the sink thread
+    sink.Submit(img, result)
+
+    # Show the latest rendered frame, and break out of the while loop when the user presses the 'q' key
+    if not sink.Show():
         break
         
 # Free up resources and close all windows
 cap.release()
-cv.destroyAllWindows()
+sink.Close()
+if publisher is not None:
+    publisher.Close()
+
+# Save stage timings
+if showTimings:
+    timer.ExportChromeTrace("trace.json")
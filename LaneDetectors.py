@@ -0,0 +1,637 @@
+# Lane detection code for EGR 530
+
+# Import helper functions file
+from HelperFunctions import *
+from StageTimer import nullTimer
+from ColorLUT import LoadColorTable, ApplyColorTable
+from LaneTracking import LaneTracker
+from StageGraph import StageGraph
+from LaneHistory import LaneHistory, MakeSmoother
+from OverlaySink import OverlayRenderer
+
+# Allocate a set of single channel frames with the same size as an image
+def AllocateFrames(img, names, owner):
+    for name in names:
+        setattr(owner, name, np.empty(img.shape[:2], dtype = np.uint8))
+
+# Calculate a steering value based on the centers of a pair of lane lines
+def CalculateSteeringValue(laneCoords, width):
+    leftLineCenter = (laneCoords[0][0] + laneCoords[0][2]) / (2 * width)
+    rightLineCenter = (laneCoords[1][0] + laneCoords[1][2]) / (2 * width)
+    return (leftLineCenter + rightLineCenter) / 2
+
+# Steps shared by both detectors
+class LaneDetector:
+    # Set the pyramid level that detection runs at: level n processes frames at 1/2^n of the full resolution
+    def SetPyramidLevel(self, level):
+        self.pyramidLevel = level
+        self.scale = 0.5 ** level
+        self.img_small = None
+
+    # Shrink a frame to the current pyramid level
+    def Downscale(self, img):
+        if self.pyramidLevel == 0:
+            return img
+        width = max(1, round(img.shape[1] * self.scale))
+        height = max(1, round(img.shape[0] * self.scale))
+        if self.img_small is None or self.img_small.shape[:2] != (height, width):
+            self.img_small = np.empty((height, width) + img.shape[2:], dtype = img.dtype)
+        with self.timer.Stage('downscale'):
+            return cv.resize(img, (width, height), dst = self.img_small, interpolation = cv.INTER_AREA)
+
+    # Isolate yellow and white, giving 255 for lane colors and 0 otherwise
+    def Recolor(self, img):
+        timer = self.timer
+
+        # Look up each pixel in the color table
+        if self.colorTable is not None:
+            with timer.Stage('color table'):
+                return ApplyColorTable(img, self.colorTable, self.img_recolor, self.img_bgra)
+
+        # Convert to HSV and isolate yellow and white
+        return self.IsolateColors(self.ConvertHSV(img))
+
+    def ConvertHSV(self, img):
+        with self.timer.Stage('hsv'):
+            return cv.cvtColor(img, cv.COLOR_BGR2HSV, dst = self.img_hsv)
+
+    # Isolate yellow and white in an HSV frame
+    def IsolateColors(self, img_hsv):
+        with self.timer.Stage('inRange'):
+            img_yellow = cv.inRange(img_hsv, self.yellowRange[0], self.yellowRange[1], dst = self.img_yellow)
+            img_white = cv.inRange(img_hsv, self.whiteRange[0], self.whiteRange[1], dst = self.img_white)
+            return np.add(img_yellow, img_white, out = self.img_recolor)
+
+# Hough based detector (LaneAnnotation.py) #############################################################################
+# Detects lane lines with geometry only (G) and geometry + color (GC), then combines the two results
+# Each step is a stage in a lazy graph (StageGraph.py), so Process only runs the stages needed for the outputs asked for
+class HoughLaneDetector(LaneDetector):
+    # Weights used to combine G and GC results, depending on which were found: (G weight, GC weight)
+    combineWeights = {
+        (True, True): (0.3, 0.7),
+        (True, False): (0.8, 0.2),
+        (False, True): (0.0, 1.0),
+    }
+
+    def __init__(self, topPointMultiplier = 0.25, bottomPointMultiplier = 0.9, laneUpdateRate = 0.1,
+                 yellowRange = ((20, 39, 64), (35, 255, 255)), whiteRange = ((0, 0, 229), (180, 38, 255)), timer = None,
+                 useColorTable = False, pyramidLevel = 0, tracking = False, paths = ('G', 'GC'),
+                 cannyThresholds = (50, 150), houghThreshold = 100, minLineLength = 100, maxLineGap = 50,
+                 smoother = 'ema', smoothingWindow = 5, historyLength = 30):
+        # Top and bottom points of the region of interest as a fraction of the frame (measured from the top)
+        self.topPointMultiplier = topPointMultiplier
+        self.bottomPointMultiplier = bottomPointMultiplier
+
+        # Canny thresholds used for edge detection, and the Hough limits (at full resolution)
+        self.cannyThresholds = tuple(cannyThresholds)
+        self.houghThreshold = houghThreshold
+        self.minLineLength = minLineLength
+        self.maxLineGap = maxLineGap
+
+        # Rate at which lane positions will update
+        self.laneUpdateRate = laneUpdateRate
+
+        # Fused lines of recent frames, and how they are smoothed into the combined lane coords: 'ema' (at
+        # laneUpdateRate), 'median' (over smoothingWindow frames), 'outlier' (EMA after rejecting outliers), or a
+        # smoother (LaneHistory.py)
+        self.history = LaneHistory(max(historyLength, smoothingWindow + 1))
+        self.smoother = MakeSmoother(smoother, laneUpdateRate, smoothingWindow)
+
+        # HSV ranges used to isolate yellow and white
+        self.yellowRange = yellowRange
+        self.whiteRange = whiteRange
+
+        # Optionally isolate yellow and white with a precomputed lookup table (ColorLUT.py) instead of HSV conversion
+        self.colorTable = LoadColorTable(yellowRange, whiteRange) if useColorTable else None
+
+        # Timer for each stage of processing (StageTimer), which does nothing if not given
+        self.timer = timer or nullTimer
+
+        # Resolution that detection runs at (lane coords are always given at full resolution)
+        self.SetPyramidLevel(pyramidLevel)
+
+        # Optionally track the lane lines and only search thin corridors around them (LaneTracking.py)
+        self.tracker = LaneTracker() if tracking else None
+
+        # Paths combined into the fused result, 'G' and/or 'GC' (a path that isn't used is never computed)
+        self.paths = tuple(paths)
+
+        # Stages of the pipeline, given the full resolution frame as 'input'
+        self.graph = StageGraph()
+        self.graph.Add('frame', self.StageFrame)
+        self.graph.Add('hsv', self.StageHSV)
+        self.graph.Add('recolor', self.StageRecolor)
+        self.graph.Add('edges', self.StageEdges)
+        self.graph.Add('recolor_edges', self.StageRecolorEdges)
+        self.graph.Add('crop', self.StageCrop)
+        self.graph.Add('recolor_crop', self.StageRecolorCrop)
+        self.graph.Add('corridors', self.StageCorridors)
+        self.graph.Add('hough_g', self.StageHoughG)
+        self.graph.Add('hough_gc', self.StageHoughGC)
+        self.graph.Add('fuse', self.StageFuse)
+        self.graph.Add('overlay', self.StageOverlay)
+
+        self.Reset()
+
+    # Clear the latest coords of detected lane lines
+    def Reset(self):
+        if self.tracker is not None:
+            self.tracker.Reset()
+
+        self.steeringValueG = 0
+        self.laneCoordsG = np.array([[0, 0, 0, 0], [0, 0, 0, 0]])
+        self.steeringValueGC = 0
+        self.laneCoordsGC = np.array([[0, 0, 0, 0], [0, 0, 0, 0]])
+        self.steeringValueCombined = 0
+        self.laneCoordsCombined = np.zeros((2, 4))
+        self.history.Clear()
+        self.cropBoundaryCoords = np.zeros((0, 4))
+        self.searchCorridors = False
+
+        # Intermediate frames are allocated on the first frame
+        self.bufferShape = None
+
+        # Overlay buffers for the 'overlay' output, reused between frames
+        self.overlayRenderer = OverlayRenderer(self.DrawOverlay)
+
+    # Allocate the intermediate frames once for each frame size, so that they can be reused between frames
+    def AllocateBuffers(self, img):
+        self.bufferShape = img.shape
+        self.img_hsv = np.empty(img.shape, dtype = np.uint8)
+        self.img_bgra = np.empty(img.shape[:2] + (4,), dtype = np.uint8)
+        AllocateFrames(img, ('img_yellow', 'img_white', 'img_recolor', 'img_gray', 'img_blur', 'img_edges',
+                             'img_recolor_edges', 'img_edges_crop', 'img_recolor_edges_crop'), self)
+
+    # Find lane lines in a cropped edge frame and update a set of lane coords (full resolution) in place
+    # Returns the lines found on each side (full resolution), or None for a side with no line
+    def UpdateLaneCoords(self, frame_edges_crop, laneCoords):
+        # Find lane lines (raises ValueError if none are found)
+        lines = FindLaneLinesHough(frame_edges_crop, self.topPointMultiplier, 1, self.scale, **self.HoughLimits())
+
+        # Update lane coords, mapping them back to full resolution
+        found = [None, None]
+        for side in (0, 1):
+            if np.count_nonzero(lines[side]):
+                found[side] = lines[side] / self.scale
+                laneCoords[side] = found[side]
+        return found
+
+    # Process a single frame and return the detection result
+    # outputs are the stages that must run, by default the fused result ('fuse'); add 'overlay' to also get the frame
+    # with the overlay drawn as result['overlay'], or ask for 'hough_g' or 'hough_gc' alone to skip the other path
+    # known can give outputs of stages that are already known for this frame, such as the hsv and edges frames saved in
+    # a frame store (FrameStore.py), which are then used instead of running those stages (pyramid level 0 only)
+    def Process(self, img, outputs = ('fuse',), known = None):
+        if known and self.pyramidLevel == 0:
+            self.graph.Start(input = img, **known)
+        else:
+            self.graph.Start(input = img)
+
+        # Allocates the intermediate frames if needed
+        self.graph.Get('frame')
+
+        # Search the corridors around the tracked lane lines if they are known, otherwise search the whole region
+        if self.tracker is not None:
+            self.tracker.Predict()
+        self.searchCorridors = self.tracker is not None and self.tracker.Confident()
+
+        for name in outputs:
+            self.graph.Get(name)
+
+        # Update the tracked lane lines with the paths that ran
+        if self.tracker is not None:
+            linesG = self.graph.Peek('hough_g', (False, [None, None]))[1]
+            linesGC = self.graph.Peek('hough_gc', (False, [None, None]))[1]
+            self.tracker.Update(self.MeasuredLines(linesG, linesGC))
+
+        result = self.Result()
+        if 'overlay' in outputs:
+            result['overlay'] = self.graph.Get('overlay')
+        return result
+
+    # Build the detection result from the stages that have run for this frame
+    def Result(self):
+        return {
+            'gFound': self.graph.Peek('hough_g', (False,))[0],
+            'steeringValueG': self.steeringValueG,
+            'laneCoordsG': self.laneCoordsG.copy(),
+            'gcFound': self.graph.Peek('hough_gc', (False,))[0],
+            'steeringValueGC': self.steeringValueGC,
+            'laneCoordsGC': self.laneCoordsGC.copy(),
+            'steeringValueCombined': self.steeringValueCombined,
+            'laneCoordsCombined': self.laneCoordsCombined.copy(),
+            'cropBoundaryCoords': self.cropBoundaryCoords / self.scale,
+            'tracking': self.searchCorridors,
+        }
+
+    # Keyword arguments for FindLaneLinesHough
+    def HoughLimits(self):
+        return {'threshold': self.houghThreshold, 'minLineLength': self.minLineLength, 'maxLineGap': self.maxLineGap}
+
+    # Pick the lines used to update the tracker: geometry only if found, otherwise geometry + color
+    def MeasuredLines(self, linesG, linesGC):
+        return [lineG if lineG is not None else lineGC for lineG, lineGC in zip(linesG, linesGC)]
+
+    # Stages ###########################################################################################################
+    # Frame at the pyramid level
+    def StageFrame(self):
+        img = self.Downscale(self.graph.Get('input'))
+
+        # Allocate intermediate frames if the frame size has changed
+        if img.shape != self.bufferShape:
+            self.AllocateBuffers(img)
+        return img
+
+    def StageHSV(self):
+        return self.ConvertHSV(self.graph.Get('frame'))
+
+    # Yellow and white isolated, from a color table lookup or the HSV frame
+    def StageRecolor(self):
+        if self.colorTable is not None:
+            return self.Recolor(self.graph.Get('frame'))
+        return self.IsolateColors(self.graph.Get('hsv'))
+
+    def StageEdges(self):
+        with self.timer.Stage('edges'):
+            return DetectEdges(self.graph.Get('frame'), self.img_edges, self.img_gray, self.img_blur, self.cannyThresholds)
+
+    def StageRecolorEdges(self):
+        img_recolor = self.graph.Get('recolor')
+        with self.timer.Stage('recolor edges'):
+            return DetectEdges(img_recolor, self.img_recolor_edges, blur = self.img_blur, thresholds = self.cannyThresholds)
+
+    # Edges cropped to the region of interest
+    def StageCrop(self):
+        img_edges = self.graph.Get('edges')
+        with self.timer.Stage('crop'):
+            (self.img_edges_crop, self.cropBoundaryCoords) = TriangularMask(img_edges, self.topPointMultiplier, self.bottomPointMultiplier, self.img_edges_crop)
+            return self.img_edges_crop
+
+    def StageRecolorCrop(self):
+        img_recolor_edges = self.graph.Get('recolor_edges')
+        with self.timer.Stage('crop'):
+            (self.img_recolor_edges_crop, self.cropBoundaryCoords) = TriangularMask(img_recolor_edges, self.topPointMultiplier, self.bottomPointMultiplier, self.img_recolor_edges_crop)
+            return self.img_recolor_edges_crop
+
+    # Thin corridors around the predicted lane lines, as a list of (side, corridor polygon, bounding box view, offset
+    # of the bounding box, corridor mask inside the bounding box)
+    def StageCorridors(self):
+        img = self.graph.Get('frame')
+        height = img.shape[0]
+        corridors = []
+        cropBoundaryCoords = []
+
+        with self.timer.Stage('corridors'):
+            for side in (0, 1):
+                polygons = self.tracker.Corridor(side, self.topPointMultiplier, 1, img.shape[1], height, self.scale)
+                cropBoundaryCoords += [np.concatenate([polygons[0][i], polygons[0][(i + 1) % 4]]) for i in range(4)]
+
+                # Get the bounding box of the corridor, limited to the frame
+                x0 = int(min(max(polygons[0, :, 0].min(), 0), img.shape[1]))
+                x1 = int(min(max(polygons[0, :, 0].max() + 1, 0), img.shape[1]))
+                y0 = int(min(max(polygons[0, :, 1].min(), 0), height))
+                y1 = int(min(max(polygons[0, :, 1].max() + 1, 0), height))
+                if x1 - x0 < 8 or y1 - y0 < 8:
+                    continue
+                img_box = img[y0:y1, x0:x1]
+
+                # Mask for the corridor inside the bounding box
+                mask = np.zeros(img_box.shape[:2], dtype = np.uint8)
+                cv.fillPoly(mask, polygons, 255, offset = (-x0, -y0))
+
+                corridors.append((side, polygons, img_box, (x0, y0), mask))
+
+        self.cropBoundaryCoords = np.array(cropBoundaryCoords).reshape(-1, 4)
+        return corridors
+
+    # Geometry only: (found, lines found on each side)
+    def StageHoughG(self):
+        if self.searchCorridors:
+            found, lines = self.SearchCorridors(False, self.laneCoordsG)
+        else:
+            img_edges_crop = self.graph.Get('crop')
+            with self.timer.Stage('hough G'):
+                found, lines = self.SearchRegion(img_edges_crop, self.laneCoordsG)
+        if found:
+            self.steeringValueG = CalculateSteeringValue(self.laneCoordsG, self.graph.Get('input').shape[1])
+        return found, lines
+
+    # Geometry + Color: (found, lines found on each side)
+    def StageHoughGC(self):
+        if self.searchCorridors:
+            found, lines = self.SearchCorridors(True, self.laneCoordsGC)
+        else:
+            img_recolor_edges_crop = self.graph.Get('recolor_crop')
+            with self.timer.Stage('hough GC'):
+                found, lines = self.SearchRegion(img_recolor_edges_crop, self.laneCoordsGC)
+        if found:
+            self.steeringValueGC = CalculateSteeringValue(self.laneCoordsGC, self.graph.Get('input').shape[1])
+        return found, lines
+
+    # Combine the G and GC results of the paths in use
+    def StageFuse(self):
+        gFound = 'G' in self.paths and self.graph.Get('hough_g')[0]
+        gcFound = 'GC' in self.paths and self.graph.Get('hough_gc')[0]
+
+        if gFound or gcFound:
+            if len(self.paths) == 2:
+                weightG, weightGC = self.combineWeights[(gFound, gcFound)]
+            else:
+                # Only one path in use, so it is the whole result
+                weightG, weightGC = (1.0, 0.0) if gFound else (0.0, 1.0)
+            self.history.Append(weightG * self.laneCoordsG + weightGC * self.laneCoordsGC, True)
+        else:
+            self.history.Append(self.laneCoordsCombined, False)
+
+        # Smooth the combined lane coords over time, and steer by the smoothed lines
+        with self.timer.Stage('smoothing'):
+            self.smoother.Smooth(self.history, self.laneCoordsCombined[None])
+        self.steeringValueCombined = CalculateSteeringValue(self.laneCoordsCombined, self.graph.Get('input').shape[1])
+        return self.steeringValueCombined
+
+    # Full resolution frame with the result drawn on it
+    def StageOverlay(self):
+        # The overlay shows the fused result, so it needs the fused stage (and the paths it combines)
+        self.graph.Get('fuse')
+        img = self.graph.Get('input')
+        with self.timer.Stage('overlay'):
+            return self.overlayRenderer.Render(img, self.Result())
+
+    # Search the whole region of interest for lane lines: (found, lines found on each side)
+    def SearchRegion(self, img_edges_crop, laneCoords):
+        try:
+            return True, self.UpdateLaneCoords(img_edges_crop, laneCoords)
+        except ValueError:
+            # If lane lines are not found
+            return False, [None, None]
+
+    # Search the corridors around the predicted lane lines: (found, lines found on each side)
+    # Only the bounding box of each corridor goes through color isolation, edge detection, and Hough
+    def SearchCorridors(self, recolor, laneCoords):
+        corridors = self.graph.Get('corridors')
+        height = self.graph.Get('frame').shape[0]
+        lines = [None, None]
+
+        with self.timer.Stage('corridor GC' if recolor else 'corridor G'):
+            for side, polygons, img_box, offset, mask in corridors:
+                # Isolate yellow and white inside the bounding box
+                if recolor:
+                    if self.colorTable is not None:
+                        img_box = ApplyColorTable(img_box, self.colorTable)
+                    else:
+                        img_box_hsv = cv.cvtColor(img_box, cv.COLOR_BGR2HSV)
+                        img_box = cv.inRange(img_box_hsv, self.yellowRange[0], self.yellowRange[1]) + cv.inRange(img_box_hsv, self.whiteRange[0], self.whiteRange[1])
+
+                frame_edges = cv.bitwise_and(DetectEdges(img_box, thresholds = self.cannyThresholds), mask)
+                try:
+                    # Only keep the line on the side this corridor is tracking
+                    line = FindLaneLinesHough(frame_edges, self.topPointMultiplier, 1, self.scale, offset, height, **self.HoughLimits())[side]
+                except ValueError:
+                    continue
+
+                # Ignore lines that leave the corridor at the top or bottom, they are most likely other edges
+                inBottom = polygons[0, 3, 0] <= line[0] <= polygons[0, 2, 0]
+                inTop = polygons[0, 0, 0] <= line[2] <= polygons[0, 1, 0]
+                if np.count_nonzero(line) and inBottom and inTop:
+                    lines[side] = line / self.scale
+                    laneCoords[side] = lines[side]
+
+        return lines[0] is not None or lines[1] is not None, lines
+
+    # Draw a detection result on an overlay, adding the rectangles drawn in to regions if given
+    def DrawOverlay(self, overlay, result, regions = None):
+        # Draw crop boundary on overlay
+        DrawLines(overlay, result['cropBoundaryCoords'], (0, 0, 255), regions = regions)
+        DrawPointer(overlay, 0.5, (0, 0, 255), regions = regions)
+
+        # Draw steering values
+        if result['gFound']:
+            DrawText(overlay, " G: " + str(round(result['steeringValueG'], 3)), 0.85, (0, 255, 0), regions = regions)
+        else:
+            DrawText(overlay, " G: error", 0.85, (0, 255, 0), regions = regions)
+        if result['gcFound']:
+            DrawText(overlay, "GC: " + str(round(result['steeringValueGC'], 3)), 0.9, (0, 255, 255), regions = regions)
+        else:
+            DrawText(overlay, "GC: error", 0.9, (0, 255, 255), regions = regions)
+        DrawText(overlay, " F: " + str(round(result['steeringValueCombined'], 3)), 0.95, (255, 0, 0), regions = regions)
+
+        # Draw detected lane lines
+        DrawLines(overlay, result['laneCoordsG'], (0, 255, 0), regions = regions)
+        DrawPointer(overlay, result['steeringValueG'], (0, 255, 0), regions = regions)
+        DrawLines(overlay, result['laneCoordsGC'], (0, 255, 255), regions = regions)
+        DrawPointer(overlay, result['steeringValueGC'], (0, 255, 255), regions = regions)
+        DrawLines(overlay, result['laneCoordsCombined'], (255, 0, 0), regions = regions)
+        DrawPointer(overlay, result['steeringValueCombined'], (255, 0, 0), regions = regions)
+        return overlay
+
+    # Flatten a detection result into a single table row
+    def ResultRow(self, result):
+        row = {
+            'steeringValueG': result['steeringValueG'],
+            'steeringValueGC': result['steeringValueGC'],
+            'steeringValueCombined': result['steeringValueCombined'],
+            'gFound': result['gFound'],
+            'gcFound': result['gcFound'],
+        }
+        for name in ('laneCoordsG', 'laneCoordsGC', 'laneCoordsCombined'):
+            for s, side in enumerate('LR'):
+                for c, coord in enumerate(('x1', 'y1', 'x2', 'y2')):
+                    row[name + '_' + side + '_' + coord] = result[name][s][c]
+        return row
+
+# Band based detector (LaneAnnotationV2.py) ############################################################################
+# Detects lane lines by fitting a line in each of a series of measurement bands that follow the lanes up the frame
+class BandLaneDetector(LaneDetector):
+    def __init__(self, measurementBands = 18, testBandMin = 2, testBandMax = 7, bottomPointMultiplier = 0.7,
+                 bandHeight = 0.04, bandWidth = 0.16, scaleFalloff = 0.9, taperOuter = 0.01, taperInner = -0.005,
+                 laneUpdateRate = 0.8, initialLaneCoord = 640,
+                 yellowRange = ((16, 39, 64), (35, 255, 255)), whiteRange = ((0, 0, 215), (180, 20, 255)), timer = None,
+                 useColorTable = False, pyramidLevel = 0, cannyThresholds = (50, 150), smoother = 'ema',
+                 smoothingWindow = 5, historyLength = 30):
+        # Number of measurement bands
+        self.measurementBands = measurementBands
+
+        # Range of bands at which the steering value will be measured (inclusive)
+        self.testBandMin = testBandMin
+        self.testBandMax = testBandMax
+
+        # Bottom of the first measurement band as a fraction of the frame (measured from the top)
+        self.bottomPointMultiplier = bottomPointMultiplier
+
+        # Starting values for band height and floating band width
+        self.bandHeight = bandHeight
+        self.bandWidth = bandWidth
+
+        # Scale reduction between subsequent bands
+        self.scaleFalloff = scaleFalloff
+
+        # Values for tapering rectangles to compensate for perspective
+        self.taperOuter = taperOuter
+        self.taperInner = taperInner
+
+        # Rate at which lane positions will update
+        self.laneUpdateRate = laneUpdateRate
+        self.initialLaneCoord = initialLaneCoord
+
+        # Lines measured in recent frames, and how they are smoothed into the lane coords: 'ema' (at laneUpdateRate),
+        # 'median' (over smoothingWindow frames), 'outlier' (EMA after rejecting outliers), or a smoother (LaneHistory.py)
+        self.history = LaneHistory(max(historyLength, smoothingWindow + 1), measurementBands)
+        self.smoother = MakeSmoother(smoother, laneUpdateRate, smoothingWindow)
+
+        # HSV ranges used to isolate yellow and white
+        self.yellowRange = yellowRange
+        self.whiteRange = whiteRange
+
+        # Canny thresholds used for edge detection
+        self.cannyThresholds = tuple(cannyThresholds)
+
+        # Optionally isolate yellow and white with a precomputed lookup table (ColorLUT.py) instead of HSV conversion
+        self.colorTable = LoadColorTable(yellowRange, whiteRange) if useColorTable else None
+
+        # Timer for each stage of processing (StageTimer), which does nothing if not given
+        self.timer = timer or nullTimer
+
+        # Resolution that detection runs at (lane coords are always given at full resolution)
+        self.SetPyramidLevel(pyramidLevel)
+
+        self.Reset()
+
+    # Lane coords are kept at the resolution detection runs at, so rescale them if the pyramid level changes
+    def SetPyramidLevel(self, level):
+        oldScale = getattr(self, 'scale', None)
+        LaneDetector.SetPyramidLevel(self, level)
+        if oldScale is not None and hasattr(self, 'laneCoords'):
+            self.laneCoords *= self.scale / oldScale
+            self.history.Scale(self.scale / oldScale)
+
+    # Clear the latest coords of detected lane lines
+    def Reset(self):
+        self.laneCoords = np.ones((self.measurementBands, 2, 4)) * self.initialLaneCoord * self.scale
+        self.steeringValue = 0
+        self.history.Clear()
+
+        # Intermediate frames are allocated on the first frame
+        self.bufferShape = None
+
+    # Allocate the intermediate frames once for each frame size, so that they can be reused between frames
+    def AllocateBuffers(self, img):
+        self.bufferShape = img.shape
+        self.img_hsv = np.empty(img.shape, dtype = np.uint8)
+        self.img_bgra = np.empty(img.shape[:2] + (4,), dtype = np.uint8)
+        AllocateFrames(img, ('img_yellow', 'img_white', 'img_recolor', 'img_blur', 'img_edges'), self)
+
+    # Process a single frame and return the detection result
+    # known can give frames that are already known for this frame, which are used instead of computing them again:
+    # 'hsv', 'recolor' (yellow and white isolated), and 'recolor_edges' (edges of the recolored frame) (pyramid level 0 only)
+    def Process(self, img, known = None):
+        timer = self.timer
+        if not known or self.pyramidLevel != 0:
+            known = {}
+
+        # Shrink the frame to the pyramid level
+        img = self.Downscale(img)
+
+        # Get the dimensions of the frame
+        width = img.shape[1]
+
+        # Allocate intermediate frames if the frame size has changed
+        if img.shape != self.bufferShape:
+            self.AllocateBuffers(img)
+
+        # Convert to HSV and isolate yellow and white
+        img_recolor = known.get('recolor')
+        if img_recolor is None:
+            if 'hsv' in known and self.colorTable is None:
+                img_recolor = self.IsolateColors(known['hsv'])
+            else:
+                img_recolor = self.Recolor(img)
+
+        # Apply edge detection
+        img_edges = known.get('recolor_edges')
+        if img_edges is None:
+            with timer.Stage('edges'):
+                img_edges = DetectEdges(img_recolor, self.img_edges, blur = self.img_blur, thresholds = self.cannyThresholds)
+
+        laneCoords = self.laneCoords
+
+        # Find lane lines in every measurement band at once
+        # found is where a line was fitted, and empty is where a band had no edges at all
+        with timer.Stage('bands'):
+            bandTops, bandBottoms, windows = self.BandWindows(width)
+            lines, found, empty = FitBandLines(img_edges, bandTops, bandBottoms, windows)
+
+        # Smooth the lane coords over time
+        with timer.Stage('smoothing'):
+            self.history.Append(lines, found)
+            self.smoother.Smooth(self.history, laneCoords)
+
+        # Calculate steering value based on centers of lines
+        # laneCoords[bands][L/R][x1/y1/x2/y2]
+        testBands = laneCoords[self.testBandMin:self.testBandMax+1]
+        leftLineCenter = (np.average(testBands[:, 0, 0]) + np.average(testBands[:, 0, 2])) / (2 * width)
+        rightLineCenter = (np.average(testBands[:, 1, 0]) + np.average(testBands[:, 1, 2])) / (2 * width)
+        self.steeringValue = (leftLineCenter + rightLineCenter) / 2
+
+        return {
+            'steeringValue': self.steeringValue,
+            'laneCoords': laneCoords / self.scale,
+            'found': found,
+            'empty': empty,
+        }
+
+    # Get the rows of each measurement band and its left and right windows (fractions of the frame), for FitBandLines
+    # Band rows are fixed. The first band's windows are the left and right halves of the frame, and each band after that
+    # is centered on the top of the line found in the band below it in the last frame
+    def BandWindows(self, width):
+        bands = self.measurementBands
+        scale = self.scaleFalloff ** np.arange(bands)
+
+        # Each band sits on top of the one below it and gets shorter by scaleFalloff
+        bandHeights = self.bandHeight * np.concatenate([[1], scale[:-1]])
+        bandTops = self.bottomPointMultiplier - np.cumsum(bandHeights)
+        bandBottoms = bandTops + bandHeights
+
+        windows = np.empty((bands, 2, 4))
+        windows[0, 0, :2] = (0.0, 0.48)
+        windows[0, 1, :2] = (0.52, 1.0)
+        for side in (0, 1):
+            centers = self.laneCoords[:-1, side, 0] / width
+            windows[1:, side, 0] = centers - self.bandWidth * scale[:-1]
+            windows[1:, side, 1] = centers + self.bandWidth * scale[:-1]
+
+        # Every pixel in a window is used for its line, so keep each window on its own side of the lane. Otherwise the
+        # windows reach across to the other line near the top of the frame, where the lines are close together
+        middle = (self.laneCoords[:-1, 0, 0] + self.laneCoords[:-1, 1, 0]) / (2 * width)
+        windows[1:, 0, 1] = np.minimum(windows[1:, 0, 1], middle)
+        windows[1:, 1, 0] = np.maximum(windows[1:, 1, 0], middle)
+
+        # Tapers move the outer top corner in and the inner top corner out to follow the perspective
+        windows[:, 0, 2] = self.taperOuter * scale
+        windows[:, 0, 3] = self.taperInner * scale
+        windows[:, 1, 2] = self.taperInner * scale
+        windows[:, 1, 3] = self.taperOuter * scale
+        return bandTops, bandBottoms, windows
+
+    # Draw a detection result on an overlay, adding the rectangles drawn in to regions if given
+    def DrawOverlay(self, overlay, result, regions = None):
+        # Draw detected lane lines
+        for bandCoords in result['laneCoords']:
+            DrawLines(overlay, bandCoords, (0, 255, 0), regions = regions)
+
+        # Draw steering value
+        DrawText(overlay, "Steering: " + str(round(result['steeringValue'], 3)), 0.98, (0, 255, 0), regions = regions)
+        DrawPointer(overlay, result['steeringValue'], (0, 255, 0), 0.9, regions = regions)
+        DrawPointer(overlay, 0.5, (0, 0, 255), regions = regions)
+        return overlay
+
+    # Flatten a detection result into a single table row
+    def ResultRow(self, result):
+        row = {'steeringValue': result['steeringValue']}
+        for b in range(self.measurementBands):
+            for s, side in enumerate('LR'):
+                prefix = 'band' + str(b) + '_' + side + '_'
+                row[prefix + 'found'] = bool(result['found'][b][s])
+                row[prefix + 'empty'] = bool(result['empty'][b][s])
+                for c, coord in enumerate(('x1', 'y1', 'x2', 'y2')):
+                    row[prefix + coord] = result['laneCoords'][b][s][c]
+        return row
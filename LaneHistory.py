@@ -0,0 +1,152 @@
+# Lane history and temporal smoothing for EGR 530
+# Keeps the lines measured in recent frames in a preallocated ring buffer, and smooths the lane coords over time with
+# filters that work on every band and side at once
+
+import numpy as np
+
+# Ring buffer of the lines measured in the last few frames, as (bands, sides, x1/y1/x2/y2) per frame
+# Nothing is allocated after construction: each frame is written into the oldest slot
+class LaneHistory:
+    def __init__(self, capacity, bands = 1, sides = 2):
+        self.capacity = capacity
+        self.coords = np.zeros((capacity, bands, sides, 4))
+        self.found = np.zeros((capacity, bands, sides), dtype = bool)
+        self.Clear()
+
+    # Forget every frame
+    def Clear(self):
+        self.found[:] = False
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # Add the lines measured in a frame, and which of them were found
+    def Append(self, coords, found):
+        self.coords[self.next] = coords
+        self.found[self.next] = found
+        self.next = (self.next + 1) % self.capacity
+        self.count += 1
+
+    # Multiply every stored coord by a factor (used when the detection resolution changes)
+    def Scale(self, factor):
+        self.coords *= factor
+
+    # Slots of the last k frames (or every stored frame), oldest first
+    def Slots(self, k = None):
+        k = len(self) if k is None else min(k, len(self))
+        return (self.next - k + np.arange(k)) % self.capacity
+
+    # Lines and found flags of the last k frames, oldest first: (k, bands, sides, 4) and (k, bands, sides)
+    def Last(self, k = None):
+        slots = self.Slots(k)
+        return self.coords[slots], self.found[slots]
+
+    # Fraction of the last k frames (or every stored frame) each line was found in: (bands, sides)
+    def Confidence(self, k = None):
+        slots = self.Slots(k)
+        if len(slots) == 0:
+            return np.zeros(self.found.shape[1:])
+        return self.found[slots].mean(axis = 0)
+
+    # Number of frames since each line was last found (the number of stored frames if it wasn't): (bands, sides)
+    def FramesSinceFound(self):
+        found = self.Last()[1][::-1]
+        return np.where(found.any(axis = 0), found.argmax(axis = 0), len(found))
+
+# Median over the first axis of values, using only the values where mask is True (NaN where there are none)
+# Sorting puts the NaNs of masked out values last, so the median can be taken from the sorted values directly, which is
+# much faster than np.nanmedian for small windows
+def MaskedMedian(values, mask):
+    values = np.sort(np.where(mask, values, np.nan), axis = 0)
+    counts = np.maximum(mask.sum(axis = 0), 1)
+    lower = np.take_along_axis(values, ((counts - 1) // 2)[None], axis = 0)[0]
+    upper = np.take_along_axis(values, (counts // 2)[None], axis = 0)[0]
+    return (lower + upper) / 2
+
+# Smoothers ############################################################################################################
+# Each smoother updates a set of lane coords (bands, sides, 4) in place from the history, after the latest frame has been
+# added to it. Lines that were not found keep their current coords
+
+# Exponential moving average: coords move a fraction (rate) of the way to each line found
+class EMASmoother:
+    def __init__(self, rate):
+        self.rate = rate
+
+    def Smooth(self, history, laneCoords, found = None):
+        slot = history.Slots(1)[0]
+        found = history.found[slot] if found is None else found
+        laneCoords[found] = self.rate * history.coords[slot][found] + (1 - self.rate) * laneCoords[found]
+        return laneCoords
+
+# Median of the lines found over the last window frames, which ignores single frame jumps entirely
+class MedianSmoother:
+    def __init__(self, window = 5):
+        self.window = window
+
+    def Smooth(self, history, laneCoords, found = None):
+        coords, windowFound = self.Window(history, found)
+        anyFound = windowFound.any(axis = 0)
+        if anyFound.any():
+            laneCoords[anyFound] = MaskedMedian(coords[:, anyFound], windowFound[:, anyFound, None])
+        return laneCoords
+
+    # Lines and found flags over the window, with the found flags of the latest frame replaced if given
+    def Window(self, history, found = None):
+        coords, windowFound = history.Last(self.window)
+        if found is not None:
+            windowFound[-1] = found
+        return coords, windowFound
+
+# Rejects lines in the latest frame that are far from the median of the lines found over the window before it, then
+# smooths what is left with another smoother (EMA by default)
+# A line is rejected if either end is more than threshold times the median absolute deviation of the window (but at
+# least minDeviation pixels) away from the median
+class OutlierSmoother:
+    def __init__(self, smoother, window = 10, threshold = 3.0, minDeviation = 20.0, minSamples = 3):
+        self.smoother = smoother
+        self.window = window
+        self.threshold = threshold
+        self.minDeviation = minDeviation
+
+        # Frames a line must have been found in over the window before anything is rejected
+        self.minSamples = minSamples
+
+        # Lines rejected in the latest frame: (bands, sides)
+        self.rejected = None
+
+    def Smooth(self, history, laneCoords, found = None):
+        coords, windowFound = history.Last(self.window + 1)
+        latest = coords[-1]
+        found = windowFound[-1] if found is None else found
+
+        # Median and deviation of each line's x coords over the window before the latest frame
+        samples = windowFound[:-1].sum(axis = 0)
+        accepted = found.copy()
+        check = found & (samples >= self.minSamples)
+        if check.any():
+            previous = coords[:-1, check][..., [0, 2]]
+            mask = windowFound[:-1, check, None]
+            median = MaskedMedian(previous, mask)
+            deviation = MaskedMedian(np.abs(previous - median), mask)
+            limit = np.maximum(self.threshold * 1.4826 * deviation, self.minDeviation)
+            accepted[check] = (np.abs(latest[check][:, [0, 2]] - median) <= limit).all(axis = 1)
+        self.rejected = found & ~accepted
+
+        return self.smoother.Smooth(history, laneCoords, accepted)
+
+# Smoothers that can be chosen by name
+smootherTypes = ('ema', 'median', 'outlier')
+
+# Make a smoother from its name, or return it if a smoother is given
+def MakeSmoother(smoother, rate, window):
+    if not isinstance(smoother, str):
+        return smoother
+    if smoother == 'ema':
+        return EMASmoother(rate)
+    if smoother == 'median':
+        return MedianSmoother(window)
+    if smoother == 'outlier':
+        return OutlierSmoother(EMASmoother(rate), window)
+    raise ValueError("Unknown smoother: " + smoother)
@@ -0,0 +1,350 @@
+# Multi-stream lane detection service for EGR 530
+# Runs lane detection on several video streams at once in one process, scheduling their frames onto a shared pool of
+# worker threads. Each stream has its own detector, so lane state never mixes between streams, and its frames are
+# processed one at a time in order. OpenCV releases the GIL while it works, so the pool spreads the streams over the cores
+# Example: python LaneService.py videos/input2.mp4 videos/test4s2.MP4 --replay --latency 100 --fps 15
+#          python LaneService.py videos/*.mp4 --workers 8 --output results
+
+import argparse
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Import helper functions file
+from HelperFunctions import *
+from FrameCapture import ThreadedCapture, ReplayCapture
+from FrameStore import StoreCapture
+from AdaptiveResolution import AdaptiveResolution
+from BatchProcess import ResultWriter, detectorTypes
+from ResultBus import ResultPublisher
+
+# One input stream with its own detector, targets, and statistics
+class Stream:
+    def __init__(self, name, cap, detector, fpsTarget = None, latencyMs = None, onResult = None, maxPending = 2, window = 300):
+        self.name = name
+        self.cap = cap
+        self.detector = detector
+
+        # Most frames per second to process (frames in between are skipped), and the oldest a frame can be when it is
+        # picked up (older frames are dropped in favour of newer ones)
+        self.fpsTarget = fpsTarget
+        self.latencyMs = latencyMs
+
+        # Called from a worker thread with (stream, frame index, timestamp, result) after each frame
+        self.onResult = onResult
+
+        # Frames read from the capture that are waiting to be processed: (frame index, frame, timestamp, arrival time)
+        self.pending = deque()
+        self.maxPending = maxPending
+        self.framesIn = 0
+        self.ended = False
+
+        # Only one frame of a stream is processed at a time, so its detector state stays in frame order
+        self.busy = False
+
+        self.processed = 0
+        self.droppedStale = 0
+        self.skippedRate = 0
+
+        # Frames whose detector or onResult call raised an exception, and the last exception
+        self.errors = 0
+        self.lastError = None
+
+        # Time (ms) of the last frame processed, from the video timestamps, or from the arrival times if the capture's
+        # timestamps don't advance (many camera backends report 0 or a constant)
+        self.lastStart = None
+        self.lastCaptureTimestamp = None
+        self.timestampsAdvance = True
+        self.lastResult = None
+        self.lastArrival = None
+
+        # Arrival time of the newest frame taken from the capture
+        self.newestArrival = None
+        self.firstProcessTime = None
+        self.lastProcessTime = None
+
+        # Recent latencies (arrival to result) and processing times, in seconds
+        self.latencies = deque(maxlen = window)
+        self.processTimes = deque(maxlen = window)
+        self.lock = threading.Lock()
+
+    # Move frames that have been decoded into the pending list
+    # Only a few frames are taken at a time, so a stream that falls behind is held back by its capture (which waits for
+    # video files, and drops the oldest frames of cameras and replays)
+    def Poll(self):
+        while not self.ended and len(self.pending) < self.maxPending:
+            item = self.cap.poll()
+            if item is None:
+                return
+            ret, frame = item
+            if not ret:
+                self.ended = True
+                return
+            arrival = self.cap.arrivalTime
+            self.newestArrival = arrival
+            timestamp = self.cap.get(cv.CAP_PROP_POS_MSEC)
+            if self.timestampsAdvance and timestamp == self.lastCaptureTimestamp:
+                # Switch the fps target over to the arrival times for the rest of the stream
+                self.timestampsAdvance = False
+                self.lastStart = None
+            self.lastCaptureTimestamp = timestamp
+            self.pending.append((self.framesIn, frame, timestamp, arrival))
+            self.framesIn += 1
+
+    # Get the next frame to process, applying the latency and fps targets, or None if there isn't one
+    def NextFrame(self, now):
+        while self.pending:
+            item = self.pending[0]
+            arrival = item[3]
+
+            # Drop frames that are already too old, as long as there is a newer one to process instead
+            if self.latencyMs is not None and len(self.pending) > 1 and (now - arrival) * 1000 > self.latencyMs:
+                self.pending.popleft()
+                self.droppedStale += 1
+                continue
+
+            # Skip frames that would take the stream over its fps target, going by the video timestamps so the target
+            # also holds when frames come from a file faster than real time (the timestamps start again if a replay loops)
+            # 1 ms of slack keeps rounding in the timestamps from skipping a frame that is exactly due
+            timestamp = item[2] if self.timestampsAdvance else item[3] * 1000
+            if self.fpsTarget is not None and self.lastStart is not None and 0 <= timestamp - self.lastStart < 1000 / self.fpsTarget - 1:
+                self.pending.popleft()
+                self.skippedRate += 1
+                continue
+
+            self.lastStart = timestamp
+            return self.pending.popleft()
+        return None
+
+    # Deadline used to choose between streams: the oldest pending frame runs out of latency first
+    def Deadline(self):
+        if not self.pending:
+            return float('inf')
+        latency = self.latencyMs / 1000 if self.latencyMs is not None else 1.0
+        return self.pending[0][3] + latency
+
+    def Finished(self):
+        return self.ended and not self.pending and not self.busy
+
+    # Statistics for the report
+    def Stats(self, now):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            processTimes = np.array(self.processTimes) * 1000
+            elapsed = (self.lastProcessTime or now) - (self.firstProcessTime or now)
+            stats = {
+                'stream': self.name,
+                'frames_in': self.framesIn,
+                'processed': self.processed,
+                # Frames the capture dropped because the stream fell behind, or a replay skipped because decoding did
+                'dropped_capture': getattr(self.cap, 'droppedFrames', 0) + getattr(getattr(self.cap, 'cap', None), 'skippedFrames', 0),
+                'dropped_stale': self.droppedStale,
+                'skipped_rate': self.skippedRate,
+                'pending': len(self.pending),
+                'errors': self.errors,
+                'fps': (self.processed - 1) / elapsed if self.processed > 1 and elapsed > 0 else 0.0,
+                'process_ms': float(np.mean(processTimes)) if len(processTimes) else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+
+                # How far the latest result is behind the newest frame taken from the capture (frames still waiting in
+                # the capture's own queue are not counted, so this can be up to the capture queue size frames low)
+                'lag_ms': max(self.newestArrival - self.lastArrival, 0.0) * 1000 if self.lastArrival is not None and not self.ended else 0.0,
+            }
+        if hasattr(self.detector, 'detector'):
+            stats['pyramid_level'] = self.detector.detector.pyramidLevel
+        return stats
+
+# Schedules the frames of every stream onto a shared pool of worker threads
+class LaneService:
+    def __init__(self, workers = None):
+        self.workers = workers or os.cpu_count()
+        self.pool = ThreadPoolExecutor(max_workers = self.workers)
+        self.streams = []
+
+        # Set by workers when they finish a frame, so the scheduler doesn't have to spin
+        self.wake = threading.Event()
+        self.startTime = None
+
+    # Add a stream from a capture object (ThreadedCapture, or anything with the same poll/read interface)
+    # With a latency target, adaptive = True also lowers the resolution of the stream when its frames take too long
+    def AddStream(self, name, cap, detector, fpsTarget = None, latencyMs = None, adaptive = False, onResult = None):
+        if adaptive:
+            budgets = [t for t in (latencyMs, 1000 / fpsTarget if fpsTarget else None) if t]
+            if budgets:
+                detector = AdaptiveResolution(detector, min(budgets))
+        stream = Stream(name, cap, detector, fpsTarget, latencyMs, onResult)
+        self.streams.append(stream)
+        return stream
+
+    # Worker thread: run a stream's detector on one frame
+    # Futures from the pool are not kept, so exceptions are caught here, counted in the stream statistics, and logged
+    # (with the traceback for the first one of each stream)
+    def ProcessFrame(self, stream, item):
+        frameIndex, frame, timestamp, arrival = item
+        try:
+            start = time.perf_counter()
+            result = stream.detector.Process(frame)
+            end = time.perf_counter()
+
+            with stream.lock:
+                stream.processed += 1
+                stream.lastResult = result
+                stream.lastArrival = arrival
+                stream.latencies.append(end - arrival)
+                stream.processTimes.append(end - start)
+                if stream.firstProcessTime is None:
+                    stream.firstProcessTime = end
+                stream.lastProcessTime = end
+
+            if stream.onResult is not None:
+                stream.onResult(stream, frameIndex, timestamp, result)
+        except Exception as e:
+            with stream.lock:
+                stream.errors += 1
+                stream.lastError = e
+                first = stream.errors == 1
+            print("Stream {}: frame {} failed: {!r}".format(stream.name, frameIndex, e))
+            if first:
+                traceback.print_exc()
+        finally:
+            stream.busy = False
+            self.wake.set()
+
+    # Run until every stream has ended, or for duration seconds
+    # report is called with the service every reportInterval seconds
+    def Run(self, duration = None, report = None, reportInterval = 1.0):
+        self.startTime = time.perf_counter()
+        nextReport = self.startTime + reportInterval
+        try:
+            while not all(stream.Finished() for stream in self.streams):
+                now = time.perf_counter()
+                if duration is not None and now - self.startTime > duration:
+                    break
+
+                # Start the idle stream with the earliest deadline on each free worker
+                for stream in self.streams:
+                    stream.Poll()
+                idle = sorted((s for s in self.streams if not s.busy and s.pending), key = Stream.Deadline)
+                for stream in idle:
+                    item = stream.NextFrame(now)
+                    if item is not None:
+                        stream.busy = True
+                        self.pool.submit(self.ProcessFrame, stream, item)
+
+                if report is not None and now >= nextReport:
+                    report(self)
+                    nextReport += reportInterval
+
+                # Wait for a worker to finish or for new frames to be decoded
+                self.wake.wait(0.002)
+                self.wake.clear()
+        finally:
+            self.pool.shutdown(wait = True)
+            for stream in self.streams:
+                stream.cap.release()
+
+    # Per-stream statistics and the totals over every stream
+    def Report(self):
+        now = time.perf_counter()
+        streams = [stream.Stats(now) for stream in self.streams]
+        elapsed = now - self.startTime if self.startTime else 0.0
+        processed = sum(s['processed'] for s in streams)
+        total = {
+            'streams': len(streams),
+            'workers': self.workers,
+            'elapsed_s': elapsed,
+            'processed': processed,
+            'throughput_fps': processed / elapsed if elapsed > 0 else 0.0,
+            'dropped': sum(s['dropped_capture'] + s['dropped_stale'] for s in streams),
+            'errors': sum(s['errors'] for s in streams),
+            'max_lag_ms': max((s['lag_ms'] for s in streams), default = 0.0),
+        }
+        return total, streams
+
+# Print a report, marking streams that are missing their targets
+def PrintReport(service):
+    total, streams = service.Report()
+    print("{:.1f} s: {} frames, {:.1f} fps over {} streams on {} workers, {} dropped, {} errors, max lag {:.0f} ms".format(
+        total['elapsed_s'], total['processed'], total['throughput_fps'], total['streams'], total['workers'], total['dropped'], total['errors'], total['max_lag_ms']))
+    for stream, stats in zip(service.streams, streams):
+        warnings = []
+        if stream.latencyMs is not None and stats['latency_p95_ms'] > stream.latencyMs:
+            warnings.append("over latency target")
+        if stream.fpsTarget is not None and stats['processed'] > 1 and stats['fps'] < 0.9 * stream.fpsTarget:
+            warnings.append("under fps target")
+        if stats['errors']:
+            warnings.append("{} frames failed".format(stats['errors']))
+        print("  {:<24} {:>6.1f} fps  process {:>6.1f} ms  latency p50 {:>6.1f} ms  p95 {:>6.1f} ms  lag {:>6.0f} ms  dropped {:>4}+{:<4} skipped {:<4} {}".format(
+            stats['stream'][-24:], stats['fps'], stats['process_ms'], stats['latency_p50_ms'], stats['latency_p95_ms'], stats['lag_ms'],
+            stats['dropped_capture'], stats['dropped_stale'], stats['skipped_rate'], ', '.join(warnings)))
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Run lane detection on several streams at once")
+    parser.add_argument('sources', nargs = '+', help = "video files, frame store folders (FrameStore.py), or camera numbers")
+    parser.add_argument('--detector', choices = sorted(detectorTypes), default = 'hough', help = "hough (LaneAnnotation.py) or bands (LaneAnnotationV2.py)")
+    parser.add_argument('--workers', type = int, default = None, help = "worker threads shared by every stream (default: one per core)")
+    parser.add_argument('--replay', action = 'store_true', help = "replay video files at their native fps, like cameras")
+    parser.add_argument('--loop', action = 'store_true', help = "with --replay, start each file again at its end")
+    parser.add_argument('--fps', type = float, default = None, help = "most frames per second to process on each stream")
+    parser.add_argument('--latency', type = float, default = None, help = "drop frames older than this many ms when a newer frame is waiting")
+    parser.add_argument('--adaptive', action = 'store_true', help = "lower the resolution of streams that can't meet --latency or --fps (AdaptiveResolution.py)")
+    parser.add_argument('--duration', type = float, default = None, help = "stop after this many seconds")
+    parser.add_argument('--output', default = None, help = "save the results of each stream as a CSV file in this directory")
+    parser.add_argument('--publish', default = None, help = "publish results to shared-memory result buses with this name, plus -N for each stream when there are several (ResultBus.py)")
+    args = parser.parse_args()
+
+    # Let the worker pool spread the work over the cores instead of each OpenCV call using every core
+    cv.setNumThreads(1)
+
+    service = LaneService(args.workers)
+    writers = {}
+    publishers = {}
+    if args.output:
+        os.makedirs(args.output, exist_ok = True)
+
+    for i, source in enumerate(args.sources):
+        name = str(i) + ':' + os.path.basename(os.path.normpath(source))
+        if source.isdigit():
+            cap = ThreadedCapture(int(source), 'live', queueSize = 2)
+        elif os.path.isdir(source):
+            cap = ThreadedCapture(ReplayCapture(StoreCapture(source), loop = args.loop), 'live', queueSize = 2) if args.replay else ThreadedCapture(StoreCapture(source), 'file')
+        elif args.replay:
+            cap = ThreadedCapture(ReplayCapture(source, loop = args.loop), 'live', queueSize = 2)
+        else:
+            cap = ThreadedCapture(source, 'file')
+
+        # Save and publish the results of the stream as they come in
+        writer = publisher = None
+        if args.output:
+            writer = writers[name] = ResultWriter(os.path.join(args.output, 'stream' + str(i) + '.csv'))
+        if args.publish:
+            busName = args.publish if len(args.sources) == 1 else args.publish + '-' + str(i)
+            publisher = publishers[name] = ResultPublisher(busName)
+
+        def onResult(stream, frameIndex, timestamp, result, writer = writer, publisher = publisher):
+            if publisher is not None:
+                publisher.Publish(frameIndex, timestamp, result, stream.lastArrival)
+            if writer is not None:
+                row = {'frame': frameIndex, 'timestamp': timestamp}
+                row.update(stream.detector.ResultRow(result))
+                writer.Write(row)
+
+        service.AddStream(name, cap, detectorTypes[args.detector](), args.fps, args.latency, args.adaptive, onResult)
+
+    try:
+        service.Run(args.duration, PrintReport)
+    finally:
+        for writer in writers.values():
+            writer.Close()
+        for publisher in publishers.values():
+            publisher.Close()
+    PrintReport(service)
+
+if __name__ == '__main__':
+    Main()
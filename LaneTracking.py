@@ -0,0 +1,130 @@
+# Lane line tracking for EGR 530
+# Predicts where each lane line will be in the next frame, so the Hough detector only has to search thin corridors
+# around the predictions instead of the whole region of interest
+
+import cv2 as cv
+import numpy as np
+
+# Get the parameters (a, b) of a line x = a * y + b from its endpoint coords
+# Lane lines are close to vertical, so x as a function of y is better behaved than y = mx + c
+def LineParameters(lineCoords):
+    x1, y1, x2, y2 = [float(v) for v in lineCoords]
+    a = (x2 - x1) / (y2 - y1)
+    return a, x1 - a * y1
+
+# Tracks a single lane line with a constant velocity Kalman filter on (a, b)
+class LaneLineTrack:
+    def __init__(self, processNoise = (1e-5, 1.0), measurementNoise = (1e-3, 25.0)):
+        self.filter = cv.KalmanFilter(4, 2)
+
+        # State is (a, b, change in a per frame, change in b per frame)
+        self.filter.transitionMatrix = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], dtype = np.float32)
+        self.filter.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype = np.float32)
+        self.filter.processNoiseCov = np.diag([processNoise[0], processNoise[1], processNoise[0], processNoise[1]]).astype(np.float32)
+        self.filter.measurementNoiseCov = np.diag(measurementNoise).astype(np.float32)
+
+        self.initialized = False
+
+        # Number of frames in a row the line has been found and missed
+        self.hits = 0
+        self.misses = 0
+
+    # Start tracking from a measured line
+    def Initialize(self, a, b):
+        self.filter.statePost = np.array([[a], [b], [0], [0]], dtype = np.float32)
+        self.filter.errorCovPost = np.diag([1e-2, 100.0, 1e-3, 10.0]).astype(np.float32)
+        self.initialized = True
+        self.hits = 1
+        self.misses = 0
+
+    # Predict the line in the next frame
+    def Predict(self):
+        if self.initialized:
+            self.filter.predict()
+
+    # Current estimate of the line parameters (a, b)
+    # (predict() also copies the prediction to statePost, so this is the prediction until a measurement arrives)
+    def Line(self):
+        state = self.filter.statePost
+        return float(state[0, 0]), float(state[1, 0])
+
+    # Update the track with a measured line, or None if the line was not found
+    def Update(self, lineCoords):
+        if lineCoords is None:
+            self.hits = 0
+            self.misses += 1
+            return
+        a, b = LineParameters(lineCoords)
+        if not self.initialized:
+            self.Initialize(a, b)
+            return
+        self.filter.correct(np.array([[a], [b]], dtype = np.float32))
+        self.hits += 1
+        self.misses = 0
+
+# Tracks the left and right lane lines
+class LaneTracker:
+    def __init__(self, corridorWidth = 0.04, acquireFrames = 3, maxMisses = 5, refreshFrames = 10):
+        # Half width of each search corridor as a fraction of the frame width (grows while a line is missed)
+        self.corridorWidth = corridorWidth
+
+        # Frames in a row a line must be found in before switching to the corridor search
+        self.acquireFrames = acquireFrames
+
+        # Frames in a row a line can be missed before the track is lost
+        self.maxMisses = maxMisses
+
+        # Frames between full searches while tracking, so the tracks can't drift onto other edges for long
+        self.refreshFrames = refreshFrames
+
+        self.Reset()
+
+    def Reset(self):
+        self.tracks = [LaneLineTrack(), LaneLineTrack()]
+        self.tracking = False
+        self.framesTracked = 0
+
+    # Predict both lines for the next frame
+    def Predict(self):
+        for track in self.tracks:
+            track.Predict()
+
+    # Check if both lines are known well enough to only search the corridors around them
+    def Confident(self):
+        return self.tracking and self.framesTracked % self.refreshFrames != 0
+
+    # Update both lines with the lines measured in a frame (full resolution coords, or None if not found)
+    def Update(self, lineCoords):
+        for track, coords in zip(self.tracks, lineCoords):
+            track.Update(coords)
+
+            # Forget a lost line, so it starts again from the next full search
+            if track.misses > self.maxMisses:
+                track.initialized = False
+                track.misses = 0
+
+        if self.tracking:
+            # Go back to the full search once a line is lost
+            self.tracking = all(track.initialized for track in self.tracks)
+        else:
+            self.tracking = all(track.initialized and track.hits >= self.acquireFrames for track in self.tracks)
+        self.framesTracked = self.framesTracked + 1 if self.tracking else 0
+
+    # Get the search corridor around a predicted line as a polygon, between topPos and bottomPos (fractions of the frame)
+    # Width and height are the size of the frame being searched and scale is its size relative to full resolution
+    def Corridor(self, side, topPos, bottomPos, width, height, scale = 1.0):
+        track = self.tracks[side]
+        a, b = track.Line()
+        halfWidth = self.corridorWidth * width * (1 + track.misses)
+
+        yTop = height * topPos
+        yBottom = height * bottomPos
+        xTop = a * yTop + b * scale
+        xBottom = a * yBottom + b * scale
+
+        return np.array([[
+            (xTop - halfWidth, yTop),
+            (xTop + halfWidth, yTop),
+            (xBottom + halfWidth, yBottom),
+            (xBottom - halfWidth, yBottom),
+        ]]).round().astype(np.int32)
@@ -0,0 +1,236 @@
+# Overlay rendering for EGR 530
+# Draws detection results on frames and writes them to a video in a separate thread, so that drawing, blending, resizing
+# and video encoding are kept out of the detection loop. The window is shown from the main thread (OverlaySink.Show),
+# since HighGUI is not thread-safe and has to run on the main thread on some platforms (macOS, Qt builds)
+
+import queue
+import threading
+import time
+
+# Import helper functions file
+from HelperFunctions import *
+from StageTimer import nullTimer
+
+# Draws detection results on frames with a detector's DrawOverlay function
+# The overlay can be cleared and blended only inside the rectangles drawn in (see AddOverlayRegions), which gives the
+# same frame as clearing and blending the whole overlay. Whether that is faster depends on how much of the frame the
+# overlay covers and on the frame size (recording, clearing and blending each rectangle costs about as much as blending
+# several thousand pixels), so both ways are timed and the faster one is used, trying the other one again every
+# recheckInterval frames in case the overlay has changed. The output frame is reused between frames when rendering with
+# rectangles, so the frame returned by Render() is only valid until the next call
+class OverlayRenderer:
+    recheckInterval = 60
+
+    def __init__(self, drawOverlay):
+        self.drawOverlay = drawOverlay
+        self.overlay = None
+        self.frame_overlay = None
+
+        # Rectangles drawn in on the last frame, or None if they weren't recorded
+        self.regions = None
+
+        # Smoothed time (seconds) to render a frame with and without rectangles, and the frames since the slower way
+        # was last tried
+        self.regionTime = None
+        self.fullTime = None
+        self.framesSinceCheck = 0
+
+    def Render(self, frame, result):
+        # Start timing again if the frame size has changed
+        if self.overlay is None or self.overlay.shape != frame.shape or self.overlay.dtype != frame.dtype:
+            self.overlay = None
+            self.regions = None
+            self.regionTime = None
+            self.fullTime = None
+
+        start = time.perf_counter()
+        useRegions = self.UseRegions()
+        if useRegions:
+            # Clear what was drawn on the previous frame
+            if self.regions is None:
+                self.overlay = InitOverlay(frame, self.overlay)
+            else:
+                ClearOverlayRegions(self.overlay, self.regions)
+            self.regions = []
+            self.drawOverlay(self.overlay, result, self.regions)
+            self.frame_overlay = AddOverlayRegions(frame, self.overlay, self.regions, self.frame_overlay)
+        else:
+            # New zeroed arrays are cheaper than clearing the old ones, since the memory is only zeroed as it is used
+            self.overlay = InitOverlay(frame)
+            self.regions = None
+            self.drawOverlay(self.overlay, result)
+            self.frame_overlay = AddOverlay(frame, self.overlay)
+        elapsed = time.perf_counter() - start
+
+        if useRegions:
+            self.regionTime = elapsed if self.regionTime is None else (self.regionTime + elapsed) / 2
+        else:
+            self.fullTime = elapsed if self.fullTime is None else (self.fullTime + elapsed) / 2
+        return self.frame_overlay
+
+    # Choose whether to render the next frame with rectangles: each way is tried once, then the faster one is used
+    def UseRegions(self):
+        if self.regionTime is None:
+            return True
+        if self.fullTime is None:
+            return False
+        faster = self.regionTime <= self.fullTime
+        self.framesSinceCheck += 1
+        if self.framesSinceCheck >= self.recheckInterval:
+            self.framesSinceCheck = 0
+            return not faster
+        return faster
+
+# Renders detection results in a separate thread: the detection loop submits each frame with its result, and the
+# rendering thread draws the overlay, resizes it for the window and/or writes it to a video. The detection loop calls
+# Show() once per frame to show the latest rendered frame and check for the 'q' key
+# Submitted frames must not be changed afterwards, since they are read by the rendering thread. Frames from read() of a
+# capture are new arrays each time, so they can be submitted as they are
+# Modes (as in ThreadedCapture):
+#  - 'live' - if rendering falls behind, the oldest queued frame is dropped so the display never holds up detection
+#  - 'file' - frames are never dropped; Submit() waits for space in the queue (annotated videos)
+class OverlaySink:
+    def __init__(self, detector, windowName = "Lane Detection", displayScale = 1.0, videoPath = None, fps = 30,
+                 mode = 'live', queueSize = 1, timer = nullTimer, showStats = False, show = True):
+        if mode not in ('live', 'file'):
+            raise ValueError("Unknown sink mode: " + str(mode))
+        self.mode = mode
+        self.renderer = OverlayRenderer(detector.DrawOverlay)
+        self.timer = timer
+
+        # Window to show the frames in (None to not show them), and the scale they are shown at
+        self.windowName = windowName if show else None
+        self.displayScale = displayScale
+
+        # Draw the stage timings of the timer on each frame
+        self.showStats = showStats
+
+        # Video to write the frames to, opened on the first frame
+        self.videoPath = videoPath
+        self.fps = fps
+        self.videoWriter = None
+
+        self.items = queue.Queue(maxsize = max(1, queueSize))
+        self.stopped = threading.Event()
+
+        # Set when 'q' is pressed in the window
+        self.quitRequested = threading.Event()
+
+        # Latest frame resized for the window, and the number of frames rendered when it was shown last
+        self.displayFrame = None
+        self.displayLock = threading.Lock()
+        self.shownFrames = 0
+
+        # Number of frames rendered and dropped, and the time (seconds) spent rendering
+        self.renderedFrames = 0
+        self.droppedFrames = 0
+        self.renderTime = 0.0
+
+        self.thread = threading.Thread(target = self.RenderLoop, daemon = True)
+        self.thread.start()
+
+    # Pass a frame and its detection result on to the rendering thread
+    def Submit(self, frame, result):
+        self.Put((frame, result))
+
+    # Add an item to the queue using the drop policy for the current mode
+    def Put(self, item):
+        while not self.stopped.is_set():
+            if self.mode == 'file':
+                try:
+                    self.items.put(item, timeout = 0.1)
+                    return
+                except queue.Full:
+                    continue
+            else:
+                try:
+                    self.items.put_nowait(item)
+                    return
+                except queue.Full:
+                    # Drop the oldest frame to make room for the new one
+                    try:
+                        if self.items.get_nowait() is not None:
+                            self.droppedFrames += 1
+                    except queue.Empty:
+                        pass
+
+    # Background thread: render frames until the sink is closed
+    def RenderLoop(self):
+        try:
+            self.RenderFrames()
+        finally:
+            # Stop Submit() from waiting on a thread that has ended
+            self.stopped.set()
+
+    def RenderFrames(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+            frame, result = item
+
+            start = time.perf_counter()
+            with self.timer.Stage('overlay'):
+                frame_overlay = self.renderer.Render(frame, result)
+
+            # Draw stage timings
+            if self.showStats:
+                self.timer.DrawStats(frame_overlay)
+
+            # Resize the frame for the window (a new array, so it stays valid while the next frame is rendered)
+            if self.windowName is not None:
+                displayFrame = ResizeFrame(frame_overlay, self.displayScale)
+                with self.displayLock:
+                    self.displayFrame = displayFrame
+
+            if self.videoPath is not None:
+                if self.videoWriter is None:
+                    self.videoWriter = cv.VideoWriter(self.videoPath, cv.VideoWriter_fourcc(*'mp4v'), self.fps,
+                                                      (frame.shape[1], frame.shape[0]))
+                with self.timer.Stage('encode'):
+                    self.videoWriter.write(frame_overlay)
+
+            self.renderTime += time.perf_counter() - start
+            with self.displayLock:
+                self.renderedFrames += 1
+
+        if self.videoWriter is not None:
+            self.videoWriter.release()
+
+    # Main thread: show the latest rendered frame if there is a new one, and check for the 'q' key
+    # Returns False once 'q' has been pressed
+    def Show(self):
+        if self.windowName is None:
+            return not self.quitRequested.is_set()
+
+        with self.displayLock:
+            displayFrame = self.displayFrame
+            rendered = self.renderedFrames
+        with self.timer.Stage('display'):
+            if displayFrame is not None and rendered != self.shownFrames:
+                cv.imshow(self.windowName, displayFrame)
+                self.shownFrames = rendered
+            if cv.waitKey(1) & 0xFF == ord('q'):
+                self.quitRequested.set()
+        return not self.quitRequested.is_set()
+
+    # Rendering statistics: frames rendered and dropped, and the mean time (milliseconds) to render a frame
+    def Stats(self):
+        return {
+            'rendered': self.renderedFrames,
+            'dropped': self.droppedFrames,
+            'render_ms': self.renderTime / self.renderedFrames * 1000 if self.renderedFrames else 0.0,
+        }
+
+    # Render the frames still queued, then stop the rendering thread and free up resources (call from the main thread)
+    def Close(self):
+        # The end marker is never dropped, even in live mode
+        while self.thread.is_alive():
+            try:
+                self.items.put(None, timeout = 0.1)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+        if self.windowName is not None and self.shownFrames:
+            cv.destroyWindow(self.windowName)
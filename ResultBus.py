@@ -0,0 +1,425 @@
+# Shared-memory result publishing for EGR 530
+# Publishes detection results as fixed-layout binary records in a ring buffer in shared memory, so another process (the
+# steering controller) can pick up each result as soon as it is written, with no serialization or system calls
+# One process publishes (ResultPublisher) and any number of processes read (ResultReader). No locks are used: each
+# record has a sequence number that is odd while it is being written, so a reader can tell when a record it copied was
+# overwritten halfway through and skip it
+# Example: python ResultBus.py monitor lanes
+#          python ResultBus.py record lanes --output drive.npy
+#          python ResultBus.py replay drive.npy --name lanes
+#          python ResultBus.py bench
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Most lines a record can hold: 6 for the Hough detector (combined, G, and GC, left and right), or 2 per band
+maxLines = 64
+
+# Layout of one record, padded so every field is aligned
+recordType = np.dtype([
+    # Sequence number of the record: 2n + 1 while record n is being written, 2n + 2 once it is complete
+    ('sequence', np.uint64),
+    ('frame', np.int64),
+
+    # Video timestamp (ms), and the time.perf_counter() times the frame was decoded and the result was published
+    # (perf_counter uses the system-wide monotonic clock, so times can be compared between processes)
+    ('timestamp', np.float64),
+    ('captureTime', np.float64),
+    ('publishTime', np.float64),
+
+    # Steering values: combined, G, and GC for the Hough detector, or the band steering value and two NaNs
+    ('steering', np.float64, (3,)),
+
+    # 0 for the Hough detector, 1 for the band detector
+    ('detector', np.uint8),
+    ('gFound', np.bool_),
+    ('gcFound', np.bool_),
+    ('lineCount', np.uint16),
+
+    # Lines as x1, y1, x2, y2 in full resolution pixels, and whether each was found in this frame
+    # Hough: combined L/R, G L/R, GC L/R. Bands: band 0 L/R, band 1 L/R, ...
+    ('lines', np.float32, (maxLines, 4)),
+    ('found', np.bool_, (maxLines,)),
+], align = True)
+
+# Layout of the header at the start of the shared memory block
+headerType = np.dtype([
+    ('magic', np.uint64),
+    ('recordSize', np.uint64),
+    ('capacity', np.uint64),
+
+    # Number of records published so far; record n is in slot n % capacity
+    ('published', np.uint64),
+
+    # Process ID of the publisher, to tell if a block was left behind by a publisher that crashed
+    ('pid', np.uint64),
+], align = True)
+
+# Marks a block as a result bus (the layout version is in the last byte)
+busMagic = 0x4547523533304C02
+
+detectorCodes = {'hough': 0, 'bands': 1}
+
+# Fill a record from the result of either detector
+def FillRecord(record, frameIndex, timestamp, result, captureTime = None):
+    record['frame'] = frameIndex
+    record['timestamp'] = timestamp
+    record['captureTime'] = np.nan if captureTime is None else captureTime
+
+    if 'steeringValueCombined' in result:
+        record['detector'] = detectorCodes['hough']
+        record['steering'] = (result['steeringValueCombined'], result['steeringValueG'], result['steeringValueGC'])
+        gFound = bool(result['gFound'])
+        gcFound = bool(result['gcFound'])
+        record['gFound'] = gFound
+        record['gcFound'] = gcFound
+        lines = record['lines']
+        lines[0:2] = result['laneCoordsCombined']
+        lines[2:4] = result['laneCoordsG']
+        lines[4:6] = result['laneCoordsGC']
+        record['found'][0:6] = (gFound or gcFound,) * 2 + (gFound,) * 2 + (gcFound,) * 2
+        record['lineCount'] = 6
+    else:
+        lineCount = min(2 * len(result['laneCoords']), maxLines)
+        record['detector'] = detectorCodes['bands']
+        record['steering'] = (result['steeringValue'], np.nan, np.nan)
+        record['gFound'] = False
+        record['gcFound'] = False
+        record['lines'][:lineCount] = np.reshape(result['laneCoords'], (-1, 4))[:lineCount]
+        record['found'][:lineCount] = np.reshape(result['found'], -1)[:lineCount]
+        record['lineCount'] = lineCount
+
+# Open an existing shared memory block without taking ownership of it
+# (before Python 3.13 every process that opens a block registers it, and the block is removed when any of them exits)
+def AttachSharedMemory(name):
+    try:
+        return shared_memory.SharedMemory(name, track = False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+# Check if a process is still running
+# On Windows a shared memory block is freed when the last process using it exits, so its publisher is always running
+def ProcessRunning(pid):
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Remove a result bus left behind by a publisher that exited without closing it (e.g. killed or crashed)
+# Raises FileExistsError if the block is not a result bus with this layout, or its publisher is still running
+def RemoveStaleBus(name):
+    block = AttachSharedMemory(name)
+    try:
+        header = np.ndarray((), headerType, block.buf).copy() if block.size >= headerType.itemsize else None
+    finally:
+        block.close()
+
+    if header is None or int(header['magic']) != busMagic:
+        raise FileExistsError("Shared memory block " + name + " already exists and is not a result bus with this layout "
+                              "(remove it, or publish under another name)")
+    pid = int(header['pid'])
+    if ProcessRunning(pid):
+        raise FileExistsError("Result bus " + name + " is already being published by process " + str(pid))
+
+    # Opened with tracking so that unlinking it doesn't leave the resource tracker with a block it never registered
+    block = shared_memory.SharedMemory(name)
+    block.close()
+    block.unlink()
+
+# Writes records into a new ring buffer. Only one publisher can write to a buffer
+# A bus left behind by a publisher that has exited is replaced
+class ResultPublisher:
+    def __init__(self, name, capacity = 256):
+        self.name = name
+        self.capacity = capacity
+        size = headerType.itemsize + capacity * recordType.itemsize
+        try:
+            self.block = shared_memory.SharedMemory(name, create = True, size = size)
+        except FileExistsError:
+            RemoveStaleBus(name)
+            self.block = shared_memory.SharedMemory(name, create = True, size = size)
+        self.header = np.ndarray((), headerType, self.block.buf)
+        self.records = np.ndarray((capacity,), recordType, self.block.buf, offset = headerType.itemsize)
+        self.records[:] = 0
+        self.header['recordSize'] = recordType.itemsize
+        self.header['capacity'] = capacity
+        self.header['published'] = 0
+        self.header['pid'] = os.getpid()
+        self.header['magic'] = busMagic
+
+        # Records are filled here and copied into the buffer in one go, so readers see a partly written record for as
+        # short a time as possible
+        self.staging = np.zeros((), recordType)
+        self.sequence = self.records['sequence']
+        self.published = 0
+
+    # Publish the result of a detector for a frame
+    def Publish(self, frameIndex, timestamp, result, captureTime = None):
+        FillRecord(self.staging, frameIndex, timestamp, result, captureTime)
+        self.PublishRecord()
+
+    # Publish the staged record, or a copy of a given record (used to replay recordings)
+    def PublishRecord(self, record = None):
+        if record is not None:
+            self.staging[...] = record
+        n = self.published
+        slot = n % self.capacity
+        self.staging['sequence'] = 2 * n + 1
+        self.staging['publishTime'] = time.perf_counter()
+
+        # Mark the slot as being written, copy the record in, then mark it complete and make it visible
+        # The sequence number and count are aligned 8 byte values, which are written in a single store
+        self.sequence[slot] = 2 * n + 1
+        self.records[slot] = self.staging
+        self.sequence[slot] = 2 * n + 2
+        self.published = n + 1
+        self.header['published'] = n + 1
+
+    def Close(self):
+        if self.block is not None:
+            del self.header, self.records, self.sequence
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+# Reads records from a ring buffer created by a ResultPublisher
+# Read() returns every record published since the last call, and Latest() only the newest
+class ResultReader:
+    def __init__(self, name, startAtLatest = True):
+        self.block = AttachSharedMemory(name)
+        self.header = np.ndarray((), headerType, self.block.buf)
+        if int(self.header['magic']) != busMagic or int(self.header['recordSize']) != recordType.itemsize:
+            self.block.close()
+            raise ValueError("Shared memory block is not a result bus with this layout: " + name)
+        self.capacity = int(self.header['capacity'])
+        self.records = np.ndarray((self.capacity,), recordType, self.block.buf, offset = headerType.itemsize)
+
+        # Index of the next record to read, and the number of records missed because the publisher overwrote them
+        self.next = int(self.header['published']) if startAtLatest else 0
+        self.lost = 0
+
+    # Number of records published so far
+    def Published(self):
+        return int(self.header['published'])
+
+    # Copy record n, or return None if it has been overwritten
+    def Copy(self, n):
+        slot = n % self.capacity
+        record = self.records[slot].copy()
+        if record['sequence'] != 2 * n + 2 or self.records['sequence'][slot] != 2 * n + 2:
+            return None
+        return record
+
+    # Get every record published since the last call, oldest first, as an array of records
+    def Read(self):
+        published = self.Published()
+        if published - self.next > self.capacity:
+            self.lost += published - self.capacity - self.next
+            self.next = published - self.capacity
+
+        records = []
+        for n in range(self.next, published):
+            record = self.Copy(n)
+            if record is None:
+                self.lost += 1
+            else:
+                records.append(record)
+        self.next = published
+        return np.array(records, recordType)
+
+    # Get the newest record, or None if nothing has been published
+    def Latest(self):
+        while True:
+            published = self.Published()
+            if published == 0:
+                return None
+            record = self.Copy(published - 1)
+            if record is not None:
+                self.next = published
+                return record
+
+    # Wait for a record newer than the last one read, and return the newest
+    # Spins for the first spinSeconds (lowest latency), then sleeps between checks. Returns None after timeout seconds
+    def Wait(self, timeout = None, spinSeconds = 0.001, sleepSeconds = 0.0002):
+        start = time.perf_counter()
+        while self.Published() <= self.next:
+            waited = time.perf_counter() - start
+            if timeout is not None and waited > timeout:
+                return None
+            if waited > spinSeconds:
+                time.sleep(sleepSeconds)
+        return self.Latest()
+
+    def Close(self):
+        if self.block is not None:
+            del self.header, self.records
+            self.block.close()
+            self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+# Lines of a record as an array of (lines, 4), with NaN for lines that were not found
+def RecordLines(record):
+    count = int(record['lineCount'])
+    lines = record['lines'][:count].astype(np.float64)
+    lines[~record['found'][:count]] = np.nan
+    return lines
+
+# Tools ################################################################################################################
+# Print each record as it is published, with the time from publishing to reading
+def Monitor(name):
+    with ResultReader(name) as reader:
+        while True:
+            record = reader.Wait(timeout = 1.0)
+            if record is None:
+                continue
+            delay = (time.perf_counter() - record['publishTime']) * 1e6
+            print("frame {:>6}  t {:>9.1f} ms  steering {:>7.3f}  G {:d} GC {:d}  lines found {:>2}/{:<2}  delay {:>6.1f} us  lost {}".format(
+                int(record['frame']), record['timestamp'], record['steering'][0], bool(record['gFound']), bool(record['gcFound']),
+                int(np.sum(record['found'][:record['lineCount']])), int(record['lineCount']), delay, reader.lost))
+
+# Save every record published until the publisher stops (or for duration seconds) to a .npy file
+def Record(name, path, duration = None, idleTimeout = 5.0):
+    records = []
+    start = time.perf_counter()
+    with ResultReader(name) as reader:
+        lastRecord = time.perf_counter()
+        while duration is None or time.perf_counter() - start < duration:
+            batch = reader.Read()
+            if len(batch):
+                records.append(batch)
+                lastRecord = time.perf_counter()
+            elif time.perf_counter() - lastRecord > idleTimeout:
+                break
+            else:
+                time.sleep(0.001)
+        lost = reader.lost
+    records = np.concatenate(records) if records else np.zeros(0, recordType)
+    np.save(path, records)
+    print("Saved {} records to {} ({} lost)".format(len(records), path, lost))
+
+# Publish a recording with the same timing as when it was recorded (or faster or slower with speed)
+def Replay(path, name, speed = 1.0, loop = False):
+    records = np.load(path)
+    if records.dtype != recordType:
+        raise ValueError("Recording has a different record layout: " + path)
+    if len(records) == 0:
+        return
+
+    with ResultPublisher(name) as publisher:
+        while True:
+            start = time.perf_counter()
+            for record in records:
+                # Sleep until just before each record is due, then spin for the rest
+                due = start + (record['publishTime'] - records[0]['publishTime']) / speed
+                if due - time.perf_counter() > 0.002:
+                    time.sleep(due - time.perf_counter() - 0.001)
+                while time.perf_counter() < due:
+                    pass
+                publisher.PublishRecord(record)
+            print("Replayed {} records".format(len(records)))
+            if not loop:
+                break
+
+# Time publishing the results of both detectors, and the handoff to a reader in another process
+def Benchmark(frames = 20000):
+    from LaneDetectors import HoughLaneDetector, BandLaneDetector
+    from SyntheticFrames import GenerateRoadSequence
+
+    # Real results from each detector
+    img = GenerateRoadSequence(1)[0]
+    results = {'hough': HoughLaneDetector().Process(img), 'bands': BandLaneDetector().Process(img)}
+
+    name = 'egr530-bench'
+    with ResultPublisher(name, capacity = 1024) as publisher:
+        for detectorName, result in results.items():
+            start = time.perf_counter()
+            for i in range(frames):
+                publisher.Publish(i, i * 33.3, result)
+            elapsed = time.perf_counter() - start
+            print("Publish ({:<5}): {:>6.2f} us per frame".format(detectorName, elapsed / frames * 1e6))
+
+        # Handoff: publish one record at a time, waiting for a reader to pick each one up, with the reader spinning
+        # the whole time (lowest latency, uses a core) and with the reader sleeping between checks
+        for spinSeconds in (5.0, 0.001):
+            # (the reader is a separate program rather than a multiprocessing child, which would share this process's
+            # shared memory tracking, like the steering controller would be)
+            command = 'from ResultBus import BenchmarkReader; BenchmarkReader({!r}, 200, {})'.format(name, spinSeconds)
+            reader = subprocess.Popen([sys.executable, '-c', command], cwd = os.path.dirname(os.path.abspath(__file__)))
+            time.sleep(1.0)
+            for i in range(200):
+                publisher.Publish(i, i * 33.3, results['hough'])
+                time.sleep(0.005)
+            reader.wait(timeout = 10)
+
+def BenchmarkReader(name, count, spinSeconds):
+    delays = []
+    with ResultReader(name) as reader:
+        while len(delays) < count:
+            record = reader.Wait(timeout = 5.0, spinSeconds = spinSeconds)
+            if record is None:
+                break
+            delays.append((time.perf_counter() - record['publishTime']) * 1e6)
+    delays = np.array(delays)
+    print("Handoff to another process ({}): median {:.1f} us, p99 {:.1f} us over {} records".format(
+        'spinning' if spinSeconds >= 1 else 'sleeping', np.median(delays), np.percentile(delays, 99), len(delays)))
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Publish and read detection results through shared memory")
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    monitor = commands.add_parser('monitor', help = "print results as they are published")
+    monitor.add_argument('name', help = "name of the result bus")
+
+    record = commands.add_parser('record', help = "save published results to a .npy file")
+    record.add_argument('name', help = "name of the result bus")
+    record.add_argument('--output', required = True, help = ".npy file to save the records to")
+    record.add_argument('--duration', type = float, default = None, help = "stop after this many seconds (default: when the publisher goes quiet)")
+
+    replay = commands.add_parser('replay', help = "publish a recording with its original timing")
+    replay.add_argument('recording', help = ".npy file saved by record")
+    replay.add_argument('--name', default = 'lanes', help = "name of the result bus to create")
+    replay.add_argument('--speed', type = float, default = 1.0, help = "playback speed")
+    replay.add_argument('--loop', action = 'store_true', help = "start again at the end of the recording")
+
+    bench = commands.add_parser('bench', help = "time publishing and the handoff to another process")
+    bench.add_argument('--frames', type = int, default = 20000, help = "records to publish for each detector")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'monitor':
+            Monitor(args.name)
+        elif args.command == 'record':
+            Record(args.name, args.output, args.duration)
+        elif args.command == 'replay':
+            Replay(args.recording, args.name, args.speed, args.loop)
+        else:
+            Benchmark(args.frames)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,44 @@
+# Lazy stage graph for EGR 530
+# Each stage is a named function that asks the graph for the outputs of the stages it needs, so a stage only runs when
+# something needs its output, and runs at most once per frame
+
+from collections import OrderedDict
+
+# Holds the stages of a pipeline and the outputs computed for the current frame:
+#   graph.Add('edges', lambda: DetectEdges(graph.Get('input')))
+#   graph.Start(input = img)
+#   img_edges = graph.Get('edges')
+class StageGraph:
+    def __init__(self):
+        # Stage functions, which take no arguments and get their inputs from the graph
+        self.stages = OrderedDict()
+
+        # Outputs computed for the current frame (including the inputs passed to Start)
+        self.values = {}
+
+    # Add a stage, replacing any existing stage with the same name
+    def Add(self, name, function):
+        self.stages[name] = function
+
+    # Start a new frame, forgetting every output computed for the last one
+    def Start(self, **inputs):
+        self.values = dict(inputs)
+
+    # Get the output of a stage, running it and the stages it needs if it hasn't run yet for this frame
+    def Get(self, name):
+        try:
+            return self.values[name]
+        except KeyError:
+            pass
+        if name not in self.stages:
+            raise KeyError("Unknown stage: " + name)
+        value = self.values[name] = self.stages[name]()
+        return value
+
+    # Get the output of a stage only if it has already run for this frame
+    def Peek(self, name, default = None):
+        return self.values.get(name, default)
+
+    # Names of the stages that have run for this frame, in the order the stages were added
+    def Computed(self):
+        return [name for name in self.stages if name in self.values]
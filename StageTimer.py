@@ -0,0 +1,112 @@
+# Stage timing for EGR 530
+# Keeps rolling timing statistics for each stage of the pipeline, and can export them as a Chrome trace
+# (open chrome://tracing or https://ui.perfetto.dev and load the JSON file)
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from HelperFunctions import DrawText
+
+# Context manager that does nothing, shared by every stage of a disabled timer so that no objects are created
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+nullStage = NullStage()
+
+# Context manager that times one run of a stage
+class TimedStage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.Record(self.name, self.start, time.perf_counter())
+        return False
+
+# Times named stages:
+#   with timer.Stage('canny'):
+#       ...
+class StageTimer:
+    def __init__(self, enabled = True, window = 120, maxTraceEvents = 200000):
+        self.enabled = enabled
+
+        # Number of recent runs of each stage used for the rolling statistics
+        self.window = window
+
+        # Recent durations (seconds) of each stage, in the order the stages were first seen
+        self.durations = OrderedDict()
+
+        # Completed stages for the Chrome trace, oldest dropped first
+        self.traceEvents = deque(maxlen = maxTraceEvents)
+        self.startTime = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def Stage(self, name):
+        if not self.enabled:
+            return nullStage
+        return TimedStage(self, name)
+
+    # Record a completed stage (times from time.perf_counter)
+    def Record(self, name, start, end):
+        with self.lock:
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = deque(maxlen = self.window)
+            durations.append(end - start)
+            self.traceEvents.append((name, start, end, threading.get_ident()))
+
+    # Get rolling statistics (milliseconds) for every stage
+    def Stats(self):
+        stats = OrderedDict()
+        with self.lock:
+            for name, durations in self.durations.items():
+                times = np.array(durations) * 1000
+                stats[name] = {
+                    'mean': float(np.mean(times)),
+                    'p50': float(np.percentile(times, 50)),
+                    'p95': float(np.percentile(times, 95)),
+                    'max': float(np.max(times)),
+                    'count': len(times),
+                }
+        return stats
+
+    # Draw the mean time of each stage in the top left corner of a frame
+    def DrawStats(self, frame, color = (255, 255, 255), startPos = 0.05, step = 0.04):
+        pos = startPos
+        for name, stats in self.Stats().items():
+            DrawText(frame, "{}: {:.1f} ms".format(name, stats['mean']), pos, color)
+            pos += step
+        return frame
+
+    # Save the recorded stages in the Chrome trace event format
+    def ExportChromeTrace(self, path):
+        pid = os.getpid()
+        with self.lock:
+            events = [{
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.startTime) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+            } for name, start, end, tid in self.traceEvents]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+# Timer used when none is given, which does not record anything
+nullTimer = StageTimer(enabled = False)
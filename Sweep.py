@@ -0,0 +1,315 @@
+# Parameter sweep for EGR 530
+# Runs a detector with every combination (or a random sample) of a grid of parameters over a set of clips on a process
+# pool, and reports the throughput and stability of each configuration
+# Stages that the configurations share are only computed once per frame: HSV once, the recolored frame once per pair of
+# HSV ranges, and edges once per Canny setting
+# Example: python Sweep.py videos/input2.mp4 --detector hough --grid sweep.json --samples 50 --workers 8
+#          python Sweep.py --synthetic 120 --detector bands
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Import helper functions file
+from HelperFunctions import *
+from LaneDetectors import HoughLaneDetector
+from FrameStore import StoreCapture
+from BatchProcess import ResultWriter, InitShardWorker, detectorTypes
+
+# Grids used when none is given, as parameter name: list of values (any detector constructor argument can be swept)
+defaultGrids = {
+    'hough': {
+        'cannyThresholds': [[30, 100], [50, 150], [80, 200]],
+        'houghThreshold': [60, 100, 140],
+        'minLineLength': [50, 100],
+        'maxLineGap': [25, 50],
+    },
+    'bands': {
+        'cannyThresholds': [[30, 100], [50, 150]],
+        'bandHeight': [0.03, 0.04, 0.05],
+        'bandWidth': [0.12, 0.16, 0.2],
+        'scaleFalloff': [0.85, 0.9, 0.95],
+        'taperOuter': [0.0, 0.01],
+    },
+}
+
+# Configurations #######################################################################################################
+# Turn JSON lists into tuples, so values can be used as keys (HSV ranges are given as [[h, s, v], [h, s, v]])
+def ToTuple(value):
+    if isinstance(value, list):
+        return tuple(ToTuple(v) for v in value)
+    return value
+
+# Get the configurations to run from a grid: every combination, or a random sample of samples combinations
+def GridConfigs(grid, samples = None, seed = 0):
+    names = sorted(grid)
+    configs = [dict(zip(names, map(ToTuple, values))) for values in itertools.product(*(grid[name] for name in names))]
+    if samples is not None and samples < len(configs):
+        configs = random.Random(seed).sample(configs, samples)
+    return configs
+
+# Key of a configuration for the stages it can share with other configurations
+def SharingKey(detector):
+    return (detector.cannyThresholds, detector.yellowRange, detector.whiteRange)
+
+# Split configurations into groups for the workers, keeping configurations that share stages together
+# Configurations with the same sharing key always go to the same group when there are at least as many keys as groups
+# (several keys can share a group, which still shares the HSV frame). With fewer keys than groups, the largest key sets
+# are split to use the spare workers, but never into pieces of fewer than minShared configurations
+def GroupConfigs(configs, detectorName, groups, minShared = 4):
+    keySets = {}
+    for i, config in enumerate(configs):
+        keySets.setdefault(repr(SharingKey(detectorTypes[detectorName](**config))), []).append((i, config))
+    keySets = sorted(keySets.values(), key = len, reverse = True)
+
+    if len(keySets) >= groups:
+        # Give each whole key set to the group with the fewest configurations so far, largest sets first
+        result = [[] for _ in range(groups)]
+        for keySet in keySets:
+            min(result, key = len).extend(keySet)
+        return [group for group in result if group]
+
+    # Hand the spare workers to the key sets with the most configurations per piece
+    pieces = [1] * len(keySets)
+    for _ in range(groups - len(keySets)):
+        best = max(range(len(keySets)), key = lambda k: len(keySets[k]) / pieces[k])
+        if len(keySets[best]) // (pieces[best] + 1) < minShared:
+            break
+        pieces[best] += 1
+
+    result = []
+    for keySet, count in zip(keySets, pieces):
+        bounds = np.linspace(0, len(keySet), count + 1).astype(int)
+        result += [keySet[bounds[j]:bounds[j + 1]] for j in range(count)]
+    return result
+
+# Shared stages ########################################################################################################
+# Outputs computed for the current frame, shared by every configuration in a worker
+class SharedStages:
+    def __init__(self):
+        self.values = {}
+        self.times = {}
+        self.computed = 0
+        self.reused = 0
+
+    # Start a new frame
+    def Start(self, img):
+        self.img = img
+        self.values = {}
+        self.times = {}
+
+    # Get a shared output, computing it if no configuration has needed it yet for this frame
+    # Returns the output and the time it took to compute (seconds)
+    def Get(self, key, function):
+        if key in self.values:
+            self.reused += 1
+        else:
+            start = time.perf_counter()
+            self.values[key] = function()
+            self.times[key] = time.perf_counter() - start
+            self.computed += 1
+        return self.values[key], self.times[key]
+
+    # Get the frames a detector can take as known stage outputs, and the time those frames took to compute
+    # (the time is added to each configuration, so throughput is what the configuration would get on its own)
+    def Known(self, detector):
+        canny, yellowRange, whiteRange = SharingKey(detector)
+        known = {}
+        cost = 0
+
+        # The geometry + color path of the Hough detector, and the band detector
+        if not isinstance(detector, HoughLaneDetector) or 'GC' in detector.paths:
+            img_hsv, t = self.Get(('hsv',), lambda: cv.cvtColor(self.img, cv.COLOR_BGR2HSV))
+            cost += t
+            img_recolor, t = self.Get(('recolor', yellowRange, whiteRange), lambda: cv.inRange(img_hsv, yellowRange[0], yellowRange[1]) + cv.inRange(img_hsv, whiteRange[0], whiteRange[1]))
+            cost += t
+            img_recolor_edges, t = self.Get(('recolor_edges', yellowRange, whiteRange, canny), lambda: DetectEdges(img_recolor, thresholds = canny))
+            cost += t
+            known.update({'hsv': img_hsv, 'recolor': img_recolor, 'recolor_edges': img_recolor_edges})
+
+        # The geometry only path of the Hough detector
+        if isinstance(detector, HoughLaneDetector) and 'G' in detector.paths:
+            img_edges, t = self.Get(('edges', canny), lambda: DetectEdges(self.img, thresholds = canny))
+            cost += t
+            known['edges'] = img_edges
+
+        return known, cost
+
+# Metrics ##############################################################################################################
+# Steering value and whether detection failed, for one result
+def SteeringAndFailure(detector, result):
+    if isinstance(detector, HoughLaneDetector):
+        # Failed if none of the paths in use found any lines
+        failed = not (result['gFound'] or result['gcFound'])
+        return result['steeringValueCombined'], float(failed)
+
+    # Fraction of the lines in the test bands that were not found
+    found = result['found'][detector.testBandMin:detector.testBandMax + 1]
+    return result['steeringValue'], 1 - float(np.mean(found))
+
+# Summarize the run of one configuration over one clip
+def RunMetrics(steering, failures, seconds):
+    steering = np.asarray(steering)
+    frames = len(steering)
+    return {
+        'frames': frames,
+        'fps': frames / seconds if seconds > 0 else float('inf'),
+        'ms_per_frame': seconds / frames * 1000 if frames else 0.0,
+
+        # Change in steering value between frames, which should be small on a real road
+        'jitter': float(np.std(np.diff(steering))) if frames > 2 else 0.0,
+        'max_step': float(np.max(np.abs(np.diff(steering)))) if frames > 1 else 0.0,
+        'failure_rate': float(np.mean(failures)) if frames else 0.0,
+    }
+
+# Workers ##############################################################################################################
+# Read the frames of a clip one at a time: a video file, a frame store folder, an image, or 'synthetic:N'
+# (SyntheticFrames.py)
+# Frames are streamed rather than read into a list, so a long recording doesn't have to fit in memory in every worker.
+# Each worker decodes a video file again, so for many groups it is faster to sweep a frame store made with FrameStore.py,
+# whose frames are memory-mapped and shared between the workers through the page cache
+def ClipFrames(source, maxFrames = None):
+    if source.startswith('synthetic:'):
+        from SyntheticFrames import GenerateRoadSequence
+        yield from GenerateRoadSequence(int(source.split(':')[1]))
+        return
+
+    if os.path.isfile(source) and os.path.splitext(source)[1].lower() in ('.png', '.jpg', '.jpeg', '.bmp'):
+        img = cv.imread(source)
+        if img is None:
+            raise IOError("Could not read image: " + source)
+        yield img
+        return
+
+    cap = StoreCapture(source) if os.path.isdir(source) else cv.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError("Could not open video: " + source)
+    try:
+        frameCount = 0
+        while maxFrames is None or frameCount < maxFrames:
+            ret, img = cap.read()
+            if not ret:
+                break
+            frameCount += 1
+            yield img
+    finally:
+        cap.release()
+
+# Worker process: run a group of configurations over a clip, frame by frame so they can share stages
+# Returns a list of (config index, metrics) and the number of shared outputs computed and reused
+def RunConfigGroup(source, detectorName, group, maxFrames = None):
+    detectors = [detectorTypes[detectorName](**config) for _, config in group]
+    steering = [[] for _ in group]
+    failures = [[] for _ in group]
+    seconds = [0.0] * len(group)
+    shared = SharedStages()
+
+    for img in ClipFrames(source, maxFrames):
+        shared.Start(img)
+        for i, detector in enumerate(detectors):
+            known, cost = shared.Known(detector)
+            start = time.perf_counter()
+            result = detector.Process(img, known = known)
+            seconds[i] += time.perf_counter() - start + cost
+
+            value, failed = SteeringAndFailure(detector, result)
+            steering[i].append(value)
+            failures[i].append(failed)
+
+    results = [(index, RunMetrics(steering[i], failures[i], seconds[i])) for i, (index, _) in enumerate(group)]
+    return results, shared.computed, shared.reused
+
+# Run every configuration over every clip, giving a list of rows (one per configuration and clip)
+def RunSweep(sources, detectorName, configs, workers = None, maxFrames = None):
+    workers = workers or os.cpu_count()
+    groups = GroupConfigs(configs, detectorName, workers)
+    rows = []
+    computed = 0
+    reused = 0
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = InitShardWorker) as pool:
+        futures = [(source, pool.submit(RunConfigGroup, source, detectorName, group, maxFrames)) for source in sources for group in groups]
+        for source, future in futures:
+            results, groupComputed, groupReused = future.result()
+            computed += groupComputed
+            reused += groupReused
+            for index, metrics in results:
+                row = {'config': index, 'source': source}
+                row.update({name: json.dumps(value) for name, value in configs[index].items()})
+                row.update(metrics)
+                rows.append(row)
+
+    rows.sort(key = lambda row: (row['config'], row['source']))
+    return rows, computed, reused
+
+# Combine the rows of each configuration over every clip, weighting by the number of frames
+def SummarizeConfigs(rows, configs):
+    summaries = []
+    for index, config in enumerate(configs):
+        configRows = [row for row in rows if row['config'] == index]
+        frames = sum(row['frames'] for row in configRows)
+        if frames == 0:
+            continue
+        seconds = sum(row['ms_per_frame'] * row['frames'] for row in configRows) / 1000
+        summaries.append({
+            'config': index,
+            'params': config,
+            'fps': frames / seconds if seconds > 0 else float('inf'),
+            'jitter': sum(row['jitter'] * row['frames'] for row in configRows) / frames,
+            'failure_rate': sum(row['failure_rate'] * row['frames'] for row in configRows) / frames,
+        })
+
+    # Most stable first
+    summaries.sort(key = lambda s: (round(s['failure_rate'], 3), s['jitter'], -s['fps']))
+    return summaries
+
+def Main():
+    parser = argparse.ArgumentParser(description = "Sweep detector parameters over a set of clips")
+    parser.add_argument('sources', nargs = '*', help = "video files, frame store folders (FrameStore.py, decoded once for every worker), or images")
+    parser.add_argument('--synthetic', type = int, default = None, help = "also run on this many synthetic road frames")
+    parser.add_argument('--detector', choices = sorted(detectorTypes), default = 'hough', help = "hough (LaneAnnotation.py) or bands (LaneAnnotationV2.py)")
+    parser.add_argument('--grid', default = None, help = "JSON file of parameter name: list of values (default: a small grid for the detector)")
+    parser.add_argument('--samples', type = int, default = None, help = "run a random sample of this many configurations instead of the whole grid")
+    parser.add_argument('--seed', type = int, default = 0, help = "seed for the random sample")
+    parser.add_argument('--workers', type = int, default = None, help = "number of processes (default: one per core)")
+    parser.add_argument('--max-frames', type = int, default = None, help = "only use this many frames of each video")
+    parser.add_argument('--output', default = None, help = "save one row per configuration and clip to this CSV or Parquet file")
+    parser.add_argument('--top', type = int, default = 10, help = "number of configurations to print")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.synthetic:
+        sources.append('synthetic:' + str(args.synthetic))
+    if not sources:
+        parser.error("give at least one source or --synthetic")
+
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    else:
+        grid = defaultGrids[args.detector]
+    configs = GridConfigs(grid, args.samples, args.seed)
+
+    print("{} configurations x {} clips".format(len(configs), len(sources)))
+    start = time.perf_counter()
+    rows, computed, reused = RunSweep(sources, args.detector, configs, args.workers, args.max_frames)
+    elapsed = time.perf_counter() - start
+    print("Finished in {:.1f} s, shared stages computed {} times and reused {} times".format(elapsed, computed, reused))
+
+    if args.output:
+        writer = ResultWriter(args.output)
+        for row in rows:
+            writer.Write(row)
+        writer.Close()
+
+    print("{:>6} {:>8} {:>9} {:>8}  {}".format('config', 'fps', 'jitter', 'failed', 'parameters'))
+    for summary in SummarizeConfigs(rows, configs)[:args.top]:
+        print("{:>6} {:>8.1f} {:>9.4f} {:>7.1f}%  {}".format(summary['config'], summary['fps'], summary['jitter'],
+                                                            summary['failure_rate'] * 100, json.dumps(summary['params'])))
+
+if __name__ == '__main__':
+    Main()
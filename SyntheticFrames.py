@@ -0,0 +1,60 @@
+# Synthetic road frames for EGR 530
+# Generates deterministic frames with a yellow left lane line and a dashed white right lane line, for testing and
+# benchmarking without any recorded video
+
+import cv2 as cv
+import numpy as np
+
+# Get the x coords of the left and right lane lines at each row y
+# Lines converge towards a vanishing point and bend sideways with curvature, which is largest near the horizon
+def LaneLineX(y, width, height, horizon, curvature = 0.0, offset = 0.0, laneWidth = 0.7):
+    # Depth goes from 0 at the bottom of the frame to 1 at the horizon
+    depth = (height - y) / (height - horizon)
+
+    # Center of the lane, shifted by the camera offset at the bottom and by the curvature further away
+    center = width * (0.5 + offset * (1 - depth) + curvature * depth ** 2)
+    halfWidth = width * laneWidth * 0.5 * (1 - depth)
+    return center - halfWidth, center + halfWidth
+
+# Generate a single road frame
+# Returns the frame (BGR) and the lane line points as an array of [left/right][point][x, y]
+def GenerateRoadFrame(width = 1280, height = 720, frameIndex = 0, seed = 0, curvature = 0.0, offset = 0.0, noise = 12.0, horizonPos = 0.4):
+    rng = np.random.default_rng(seed * 100003 + frameIndex)
+    horizon = round(height * horizonPos)
+
+    # Sky and road background
+    frame = np.empty((height, width, 3), dtype = np.uint8)
+    frame[:horizon] = (200, 170, 140)
+    frame[horizon:] = (85, 85, 85)
+
+    # Points along each lane line, from the bottom of the frame up to just below the horizon
+    ys = np.linspace(height, horizon + (height - horizon) * 0.05, 40)
+    leftX, rightX = LaneLineX(ys, width, height, horizon, curvature, offset)
+    lanePoints = np.stack([np.stack([leftX, ys], axis = 1), np.stack([rightX, ys], axis = 1)])
+
+    # Lines get thinner with distance
+    thickness = np.maximum(1, np.round(width * 0.012 * (ys - horizon) / (height - horizon))).astype(int)
+
+    for i in range(len(ys) - 1):
+        # Left line is solid yellow
+        cv.line(frame, (int(leftX[i]), int(ys[i])), (int(leftX[i + 1]), int(ys[i + 1])), (0, 210, 230), int(thickness[i]), cv.LINE_AA)
+
+        # Right line is dashed white, with the dashes moving towards the camera as the frame index increases
+        if (i + frameIndex // 2) % 4 < 2:
+            cv.line(frame, (int(rightX[i]), int(ys[i])), (int(rightX[i + 1]), int(ys[i + 1])), (245, 245, 245), int(thickness[i]), cv.LINE_AA)
+
+    # Add sensor noise
+    if noise > 0:
+        frame = cv.add(frame, rng.normal(0, noise, frame.shape).astype(np.int16), dtype = cv.CV_8U)
+
+    return frame, lanePoints
+
+# Generate a sequence of frames on a gently winding road
+def GenerateRoadSequence(frameCount, width = 1280, height = 720, seed = 0, maxCurvature = 0.15, noise = 12.0):
+    frames = []
+    for i in range(frameCount):
+        curvature = maxCurvature * np.sin(2 * np.pi * i / 120)
+        offset = 0.05 * np.sin(2 * np.pi * i / 90)
+        frame, _ = GenerateRoadFrame(width, height, i, seed, curvature, offset, noise)
+        frames.append(frame)
+    return frames